@@ -7,8 +7,11 @@ import os
 import sys
 import traceback
 from os.path import join as pjoin
-import math, numbers
-import decimal
+
+import numpy as np
+
+from util.LibRaster import load_raster_template
+from util.LibTimdep import iter_timesteps
 
 
 def usage():
@@ -29,17 +32,10 @@ Usage: ./FLO2DTOLEVELGRID_GEN.py [-d YYYY-MM-DD] [-t HH:MM:SS] [-p -o -h] [-S YY
     print(usage_text)
 
 
-def get_water_level_grid(lines):
-    waterLevels = []
-    for line in lines[1:]:
-        if line == '\n':
-            break
-        v = line.split()
-        # Get flood level (Elevation)
-        # waterLevels.append('%s %s' % (v[0], v[1]))
-        # Get flood depth (Depth)
-        waterLevels.append('%s %s' % (v[0], v[1]))
-    return waterLevels
+def get_water_level_grid(levels):
+    # Cells which are not present in the timestep are NaN
+    cells = np.flatnonzero(~np.isnan(levels))
+    return cells, levels[cells]
 
 
 # def get_esri_grid(waterLevels, boudary, CellMap, gap=250.0, missingVal=-9):
@@ -89,7 +85,7 @@ def get_water_level_grid(lines):
 #     EsriGrid.append('%s\n' % (' '.join(str(x) for x in arr)))
 # return EsriGrid
 
-def get_esri_grid(waterLevels, boudary, CellMap, gap=30.0, missingVal=-9999):
+def get_esri_grid(waterLevels, Template):
     "Esri GRID format : https://en.wikipedia.org/wiki/Esri_grid"
     "ncols         4"
     "nrows         6"
@@ -104,101 +100,9 @@ def get_esri_grid(waterLevels, boudary, CellMap, gap=30.0, missingVal=-9999):
     "88 75 27 9"
     "13 5 1 -9999"
 
-    EsriGrid = []
-
-    # For Niluka
-    # ncols:492
-    # nrows:533
-    # xllcorner:396935.00000
-    # yllcorner:482565.00000
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    # rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-    rows = 533
-    # print('>>>>>  cols: %d, rows: %d' % (cols, rows))
-
-    Grid = [[missingVal for x in range(cols)] for y in range(rows)]
-
-    print(Grid)
-
-    for level in waterLevels:
-        v = level.split()
-        i, j = CellMap[int(v[0])]
-        water_level = round(decimal.Decimal(v[1]), 2)
-        if (i >= cols or j >= rows):
-            print('i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-        if water_level >= WATER_LEVEL_DEPTH_MIN:
-            # Grid[j][i] = float(v[1])
-            Grid[j][i] = water_level
-
-    print('ncols:', cols)
-    print('nrows:', rows)
-    print('xllcorner:', boudary['long_min'] - gap / 2)
-    print('yllcorner:', boudary['lat_min'] - gap / 2)
-
-    EsriGrid.append('%s\t%s\n' % ('ncols', cols))
-    EsriGrid.append('%s\t%s\n' % ('nrows', rows))
-    EsriGrid.append('%s\t%s\n' % ('xllcorner', boudary['long_min'] - gap / 2))
-    EsriGrid.append('%s\t%s\n' % ('yllcorner', boudary['lat_min'] - gap / 2))
-    EsriGrid.append('%s\t%s\n' % ('cellsize', gap))
-    EsriGrid.append('%s\t%s\n' % ('NODATA_value', missingVal))
-
-    for j in range(0, rows):
-        arr = []
-        for i in range(0, cols):
-            arr.append(Grid[j][i])
-
-        EsriGrid.append('%s\n' % (' '.join(str(x) for x in arr)))
-    return EsriGrid
-
-
-def get_grid_boudary(gap=250.0):
-    "longitude  -> x : larger value"
-    "latitude   -> y : smaller value"
-
-    long_min = 1000000000.0
-    lat_min = 1000000000.0
-    long_max = 0.0
-    lat_max = 0.0
-
-    with open(CADPTS_DAT_FILE_PATH) as f:
-        lines = f.readlines()
-        for line in lines:
-            values = line.split()
-            long_min = min(long_min, float(values[1]))
-            lat_min = min(lat_min, float(values[2]))
-
-            long_max = max(long_max, float(values[1]))
-            lat_max = max(lat_max, float(values[2]))
-
-    return {
-        'long_min': long_min,
-        'lat_min': lat_min,
-        'long_max': long_max,
-        'lat_max': lat_max
-    }
-
-
-def get_cell_grid(boudary, gap=250.0):
-    CellMap = {}
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-
-    with open(CADPTS_DAT_FILE_PATH) as f:
-        lines = f.readlines()
-        for line in lines:
-            v = line.split()
-            i = int((float(v[1]) - boudary['long_min']) / gap)
-            j = int((float(v[2]) - boudary['lat_min']) / gap)
-            if not isinstance(i, numbers.Integral) or not isinstance(j, numbers.Integral):
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if (i >= cols or j >= rows):
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if i >= 0 or j >= 0:
-                CellMap[int(v[0])] = (i, rows - j - 1)
-
-    return CellMap
+    cells, levels = waterLevels
+    Grid = Template.build_grid(cells, levels, threshold=WATER_LEVEL_DEPTH_MIN, decimals=2)
+    return Template.format_grid(Grid, decimals=2)
 
 
 try:
@@ -213,6 +117,7 @@ try:
     FLO2D_MODEL = 'FLO2D_30'
     GRID_SIZE = 150
     WATER_LEVEL_DEPTH_MIN = 0.3
+    CACHE_DIR = None  # Default cache directory of util.LibCache
 
     CADPTS_DAT_FILE = 'CADPTS.DAT'
 
@@ -228,6 +133,8 @@ try:
         CADPTS_DAT_FILE = CONFIG['CADPTS_DAT_FILE']
     if 'WATER_LEVEL_DEPTH_MIN' in CONFIG:
         WATER_LEVEL_DEPTH_MIN = CONFIG['WATER_LEVEL_DEPTH_MIN']
+    if 'CACHE_DIR' in CONFIG:
+        CACHE_DIR = CONFIG['CACHE_DIR']
 
     date = ''
     time = ''
@@ -368,46 +275,32 @@ try:
     if not os.path.exists(OUTPUT_DIR_PATH):
         os.makedirs(OUTPUT_DIR_PATH)
 
-    buffer_size = 65536
-    with open(TIMEDEP_FILE_PATH) as infile:
-        waterLevelLines = []
-        boundary = get_grid_boudary(gap=GRID_SIZE)
-        # print("boundary : ", boundary)
-        CellGrid = get_cell_grid(boundary, gap=GRID_SIZE)
-        # print("CellGrid : ", CellGrid)
-        while True:
-            lines = infile.readlines(buffer_size)
-            if not lines:
-                break
-            for line in lines:
-                if len(line.split()) == 1:
-                    if len(waterLevelLines) > 0:
-                        waterLevels = get_water_level_grid(waterLevelLines)
-                        EsriGrid = get_esri_grid(waterLevels, boundary, CellGrid, gap=GRID_SIZE)
-
-                        # Create Directory
-                        if not os.path.exists(WATER_LEVEL_DIR_PATH):
-                            os.makedirs(WATER_LEVEL_DIR_PATH)
-                        # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
-                        ModelTime = float(waterLevelLines[0].split()[0])
-                        fileModelTime = datetime.datetime.strptime('%s %s' % (start_date, start_time),
-                                                                   '%Y-%m-%d %H:%M:%S')
-                        fileModelTime = fileModelTime + datetime.timedelta(hours=ModelTime)
-                        dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
-                        if fileModelTime >= now:
-                            # Create files
-                            fileName = WATER_LEVEL_FILE.rsplit('.', 1)
-                            fileName = "%s-%s.%s" % (fileName[0], dateAndTime, fileName[1])
-                            WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
-                            file = open(WATER_LEVEL_FILE_PATH, 'w')
-                            file.writelines(EsriGrid)
-                            file.close()
-                            print('Write to :', fileName)
-                        else:
-                            print('Skip. Current model time:' + dateAndTime +
-                                  ' is not greater than ' + now.strftime("%Y-%m-%d_%H-%M-%S"))
-                        waterLevelLines = []
-                waterLevelLines.append(line)
+    Template = load_raster_template(CADPTS_DAT_FILE_PATH, gap=GRID_SIZE, cache_dir=CACHE_DIR)
+    print('Raster template :', Template)
+    for ModelTime, levels in iter_timesteps(TIMEDEP_FILE_PATH, dtype=np.float64):
+        waterLevels = get_water_level_grid(levels)
+        EsriGrid = get_esri_grid(waterLevels, Template)
+
+        # Create Directory
+        if not os.path.exists(WATER_LEVEL_DIR_PATH):
+            os.makedirs(WATER_LEVEL_DIR_PATH)
+        # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
+        fileModelTime = datetime.datetime.strptime('%s %s' % (start_date, start_time),
+                                                   '%Y-%m-%d %H:%M:%S')
+        fileModelTime = fileModelTime + datetime.timedelta(hours=ModelTime)
+        dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
+        if fileModelTime >= now:
+            # Create files
+            fileName = WATER_LEVEL_FILE.rsplit('.', 1)
+            fileName = "%s-%s.%s" % (fileName[0], dateAndTime, fileName[1])
+            WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
+            file = open(WATER_LEVEL_FILE_PATH, 'w')
+            file.writelines(EsriGrid)
+            file.close()
+            print('Write to :', fileName)
+        else:
+            print('Skip. Current model time:' + dateAndTime +
+                  ' is not greater than ' + now.strftime("%Y-%m-%d_%H-%M-%S"))
 
 except Exception as e:
     print(e)
@@ -7,7 +7,14 @@ import os
 import sys
 import traceback
 from os.path import join as pjoin
-import math, numbers
+
+import numpy as np
+
+from util.LibFloodEnvelope import FloodEnvelope
+from util.LibInundation import DEPTH_CLASSES as DEFAULT_DEPTH_CLASSES, InundationStats, check_stats_format
+from util.LibRaster import RasterManifest, RasterWriterPool, get_decimals, load_raster_template, open_raster_stacks
+from util.LibRaster import save_grids
+from util.LibTimdep import load_timdep
 
 
 def usage():
@@ -24,24 +31,30 @@ Usage: ./FLO2DTOLEVELGRID_GEN.py [-d YYYY-MM-DD] [-t HH:MM:SS] [-p -o -h] [-S YY
                     Default is 'water_level-<YYYY-MM-DD>' and 'water_level_grid-<YYYY-MM-DD>' same as -d option value.
 -S  --start_date    Base Date of FLO2D model output in YYYY-MM-DD format. Default is same as -d option value.
 -T  --start_time    Base Time of FLO2D model output in HH:MM:SS format. Default is set to 00:00:00
+    --format        Comma separated raster output formats of asc (ESRI ASCII grid), asc.gz and asc.zst
+                    (compressed ESRI ASCII grid), flt (ESRI binary grid),
+                    tif (tiled GeoTIFF), nc (single NetCDF4 file of all timesteps) and sparse (single file of wet
+                    cells of all timesteps). Default is asc.
+    --writers       Number of background threads which write rasters while the next timesteps are processed.
+                    Default is 0, which writes each raster before continuing.
+
+With FLOOD_ENVELOPE enabled in CONFIG.dist.json (default), max_depth, max_depth_time, first_wet_time and wet_duration
+rasters of the written timesteps, i.e. from -d and -t onwards, are also written to the SUMMARY_DIR (default summary)
+subdirectory of the output directory. Times are in model hours since the base time.
+With INUNDATION_STATS set to csv (default) or parquet, the wet area and the flooded area of each of DEPTH_CLASSES
+of each written timestep are saved as a table to inundation_stats.csv (or .parquet) in SUMMARY_DIR. Parquet output
+requires pyarrow.
 """
     print(usage_text)
 
 
-def get_water_level_grid(lines):
-    waterLevels = []
-    for line in lines[1:]:
-        if line == '\n':
-            break
-        v = line.split()
-        # Get flood level (Elevation)
-        # waterLevels.append('%s %s' % (v[0], v[1]))
-        # Get flood depth (Depth)
-        waterLevels.append('%s %s' % (v[0], v[1]))
-    return waterLevels
+def get_water_level_grid(levels):
+    # Cells which are not present in the timestep are NaN
+    cells = np.flatnonzero(~np.isnan(levels))
+    return cells, levels[cells]
 
 
-def get_esri_grid(waterLevels, boudary, CellMap, gap=250.0, missingVal=-9):
+def get_grid(waterLevels, Template):
     "Esri GRID format : https://en.wikipedia.org/wiki/Esri_grid"
     "ncols         4"
     "nrows         6"
@@ -56,86 +69,8 @@ def get_esri_grid(waterLevels, boudary, CellMap, gap=250.0, missingVal=-9):
     "88 75 27 9"
     "13 5 1 -9999"
 
-    EsriGrid = []
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-    # print('>>>>>  cols: %d, rows: %d' % (cols, rows))
-
-    Grid = [[missingVal for x in range(cols)] for y in range(rows)]
-
-    for level in waterLevels:
-        v = level.split()
-        i, j = CellMap[int(v[0])]
-        if (i >= cols or j >= rows):
-            print('i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            print(boudary)
-        if float(v[1]) >= WATER_LEVEL_DEPTH_MIN:
-            Grid[j][i] = float(v[1])
-
-    EsriGrid.append('%s\t%s\n' % ('ncols', cols))
-    EsriGrid.append('%s\t%s\n' % ('nrows', rows))
-    EsriGrid.append('%s\t%s\n' % ('xllcorner', boudary['long_min'] - 125))
-    EsriGrid.append('%s\t%s\n' % ('yllcorner', boudary['lat_min'] - 125))
-    EsriGrid.append('%s\t%s\n' % ('cellsize', gap))
-    EsriGrid.append('%s\t%s\n' % ('NODATA_value', missingVal))
-
-    for j in range(0, rows):
-        arr = []
-        for i in range(0, cols):
-            arr.append(Grid[j][i])
-
-        EsriGrid.append('%s\n' % (' '.join(str(x) for x in arr)))
-    return EsriGrid
-
-
-def get_grid_boudary(gap=250.0):
-    "longitude  -> x : larger value"
-    "latitude   -> y : smaller value"
-
-    long_min = 1000000000.0
-    lat_min = 1000000000.0
-    long_max = 0.0
-    lat_max = 0.0
-
-    with open(CADPTS_DAT_FILE_PATH) as f:
-        lines = f.readlines()
-        for line in lines:
-            values = line.split()
-            long_min = min(long_min, float(values[1]))
-            lat_min = min(lat_min, float(values[2]))
-
-            long_max = max(long_max, float(values[1]))
-            lat_max = max(lat_max, float(values[2]))
-
-    return {
-        'long_min': long_min,
-        'lat_min': lat_min,
-        'long_max': long_max,
-        'lat_max': lat_max
-    }
-
-
-def get_cell_grid(boudary, gap=250.0):
-    CellMap = {}
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-
-    with open(CADPTS_DAT_FILE_PATH) as f:
-        lines = f.readlines()
-        for line in lines:
-            v = line.split()
-            i = int((float(v[1]) - boudary['long_min']) / gap)
-            j = int((float(v[2]) - boudary['lat_min']) / gap)
-            if not isinstance(i, numbers.Integral) or not isinstance(j, numbers.Integral):
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if (i >= cols or j >= rows):
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if i >= 0 or j >= 0:
-                CellMap[int(v[0])] = (i, rows - j - 1)
-
-    return CellMap
+    cells, levels = waterLevels
+    return Template.build_grid(cells, levels, threshold=WATER_LEVEL_DEPTH_MIN)
 
 
 try:
@@ -150,6 +85,15 @@ try:
     FLO2D_MODEL = 'FLO2D_30'
     GRID_SIZE = 150
     WATER_LEVEL_DEPTH_MIN = 0.3
+    CACHE_DIR = None  # Default cache directory of util.LibCache
+    PARSER_PROCESSES = 1
+    OUTPUT_FORMATS = ['asc']
+    WRITER_THREADS = 0
+    SKIP_UNCHANGED = True
+    FLOOD_ENVELOPE = True
+    SUMMARY_DIR = 'summary'
+    INUNDATION_STATS = 'csv'
+    DEPTH_CLASSES = DEFAULT_DEPTH_CLASSES
 
     CADPTS_DAT_FILE = 'CADPTS.DAT'
 
@@ -165,6 +109,24 @@ try:
         CADPTS_DAT_FILE = CONFIG['CADPTS_DAT_FILE']
     if 'WATER_LEVEL_DEPTH_MIN' in CONFIG:
         WATER_LEVEL_DEPTH_MIN = CONFIG['WATER_LEVEL_DEPTH_MIN']
+    if 'CACHE_DIR' in CONFIG:
+        CACHE_DIR = CONFIG['CACHE_DIR']
+    if 'PARSER_PROCESSES' in CONFIG:
+        PARSER_PROCESSES = int(CONFIG['PARSER_PROCESSES'])
+    if 'OUTPUT_FORMATS' in CONFIG:
+        OUTPUT_FORMATS = CONFIG['OUTPUT_FORMATS']
+    if 'WRITER_THREADS' in CONFIG:
+        WRITER_THREADS = int(CONFIG['WRITER_THREADS'])
+    if 'SKIP_UNCHANGED' in CONFIG:
+        SKIP_UNCHANGED = CONFIG['SKIP_UNCHANGED']
+    if 'FLOOD_ENVELOPE' in CONFIG:
+        FLOOD_ENVELOPE = CONFIG['FLOOD_ENVELOPE']
+    if 'SUMMARY_DIR' in CONFIG:
+        SUMMARY_DIR = CONFIG['SUMMARY_DIR']
+    if 'INUNDATION_STATS' in CONFIG:
+        INUNDATION_STATS = CONFIG['INUNDATION_STATS']
+    if 'DEPTH_CLASSES' in CONFIG:
+        DEPTH_CLASSES = CONFIG['DEPTH_CLASSES']
 
     date = ''
     time = ''
@@ -178,7 +140,7 @@ try:
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hF:d:t:p:o:S:T:fn:",
                                    ["help", "flo2d_config=", "date=", "time=", "path=", "out=", "start_date=",
-                                    "start_time=", "name=", "forceInsert"])
+                                    "start_time=", "name=", "forceInsert", "format=", "writers="])
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -204,6 +166,13 @@ try:
             run_name = arg.strip()
         elif opt in ("-f", "--forceInsert"):
             forceInsert = True
+        elif opt == "--format":
+            OUTPUT_FORMATS = [f.strip() for f in arg.split(',')]
+        elif opt == "--writers":
+            WRITER_THREADS = int(arg)
+    # Fail before processing, rather than when the table is saved at the end of the run
+    if INUNDATION_STATS:
+        check_stats_format(INUNDATION_STATS)
 
     print("Current working directory : ", CWD)
 
@@ -293,6 +262,8 @@ try:
         WATER_LEVEL_DIR_PATH = pjoin(OUTPUT_DIR_PATH, "%s-%s" % (WATER_LEVEL_DIR, FLO2D_CONFIG['FLO2D_OUTPUT_SUFFIX']))
     if output_suffix:
         WATER_LEVEL_DIR_PATH = pjoin(OUTPUT_DIR_PATH, "%s-%s" % (WATER_LEVEL_DIR, output_suffix))
+    # Rasters and tables of the whole run are kept apart from the rasters of the timesteps
+    SUMMARY_DIR_PATH = pjoin(WATER_LEVEL_DIR_PATH, SUMMARY_DIR)
 
     print('Processing FLO2D model on', appDir)
 
@@ -305,46 +276,73 @@ try:
     if not os.path.exists(OUTPUT_DIR_PATH):
         os.makedirs(OUTPUT_DIR_PATH)
 
-    buffer_size = 65536
-    with open(TIMEDEP_FILE_PATH) as infile:
-        waterLevelLines = []
-        boundary = get_grid_boudary(gap=GRID_SIZE)
-        # print("boundary : ", boundary)
-        CellGrid = get_cell_grid(boundary, gap=GRID_SIZE)
-        # print("CellGrid : ", CellGrid)
-        while True:
-            lines = infile.readlines(buffer_size)
-            if not lines:
-                break
-            for line in lines:
-                if len(line.split()) == 1:
-                    if len(waterLevelLines) > 0:
-                        waterLevels = get_water_level_grid(waterLevelLines)
-                        EsriGrid = get_esri_grid(waterLevels, boundary, CellGrid, gap=GRID_SIZE)
-
-                        # Create Directory
-                        if not os.path.exists(WATER_LEVEL_DIR_PATH):
-                            os.makedirs(WATER_LEVEL_DIR_PATH)
-                        # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
-                        ModelTime = float(waterLevelLines[0].split()[0])
-                        fileModelTime = datetime.datetime.strptime('%s %s' % (start_date, start_time),
-                                                                   '%Y-%m-%d %H:%M:%S')
-                        fileModelTime = fileModelTime + datetime.timedelta(hours=ModelTime)
-                        dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
-                        if fileModelTime >= now:
-                            # Create files
-                            fileName = WATER_LEVEL_FILE.rsplit('.', 1)
-                            fileName = "%s-%s.%s" % (fileName[0], dateAndTime, fileName[1])
-                            WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
-                            file = open(WATER_LEVEL_FILE_PATH, 'w')
-                            file.writelines(EsriGrid)
-                            file.close()
-                            print('Write to :', fileName)
-                        else:
-                            print('Skip. Current model time:' + dateAndTime +
-                                  ' is not greater than ' + now.strftime("%Y-%m-%d_%H-%M-%S"))
-                        waterLevelLines = []
-                waterLevelLines.append(line)
+    Template = load_raster_template(CADPTS_DAT_FILE_PATH, gap=GRID_SIZE, nodata=-9, origin_offset=125,
+                                    cache_dir=CACHE_DIR)
+    print('Raster template :', Template)
+    hours, depths = load_timdep(TIMEDEP_FILE_PATH, dtype=np.float64, cache_dir=CACHE_DIR,
+                                processes=PARSER_PROCESSES)
+    baseTime = datetime.datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
+    if not os.path.exists(WATER_LEVEL_DIR_PATH):
+        os.makedirs(WATER_LEVEL_DIR_PATH)
+    Stacks = open_raster_stacks(pjoin(WATER_LEVEL_DIR_PATH, WATER_LEVEL_FILE), Template, baseTime, OUTPUT_FORMATS)
+    Writers = RasterWriterPool(threads=WRITER_THREADS)
+    # Content hashes of rasters of previous runs, so that unchanged rasters are not written again
+    Manifest = RasterManifest(WATER_LEVEL_DIR_PATH) if SKIP_UNCHANGED else None
+    # Maximum depth, time of maximum, first wet time and wet duration of the timesteps, updated in a single pass
+    Envelope = FloodEnvelope(Template) if FLOOD_ENVELOPE else None
+    # Flooded area of each depth class of each timestep, computed while the grids are in memory
+    Stats = InundationStats(Template, baseTime, DEPTH_CLASSES, INUNDATION_STATS) if INUNDATION_STATS else None
+    try:
+        for ModelTime, levels in zip(hours, depths):
+            waterLevels = get_water_level_grid(levels)
+            Grid = get_grid(waterLevels, Template)
+
+            # Create Directory
+            if not os.path.exists(WATER_LEVEL_DIR_PATH):
+                os.makedirs(WATER_LEVEL_DIR_PATH)
+            # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
+            fileModelTime = datetime.datetime.strptime('%s %s' % (start_date, start_time),
+                                                       '%Y-%m-%d %H:%M:%S')
+            fileModelTime = fileModelTime + datetime.timedelta(hours=ModelTime)
+            dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
+            if fileModelTime >= now:
+                # Create files
+                fileName = WATER_LEVEL_FILE.rsplit('.', 1)
+                fileName = "%s-%s.%s" % (fileName[0], dateAndTime, fileName[1])
+                WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
+                # Written with the decimal places of the levels of TIMDEP.OUT, and at least one as str(level) did
+                Writers.submit(save_grids, WATER_LEVEL_FILE_PATH, Grid, Template, OUTPUT_FORMATS,
+                               decimals=get_decimals(waterLevels[1], min_decimals=1), trim=True, manifest=Manifest)
+                for Stack in Stacks:
+                    Stack.append(ModelTime, Grid)
+                # The summary covers the same timesteps as the rasters and the stacks
+                if Envelope is not None:
+                    Envelope.update(ModelTime, Grid)
+                if Stats is not None:
+                    Stats.append(ModelTime, Grid)
+            else:
+                print('Skip. Current model time:' + dateAndTime +
+                      ' is not greater than ' + now.strftime("%Y-%m-%d_%H-%M-%S"))
+    finally:
+        # Queued writes are drained and their errors raised, and the manifest and stacks are saved even if a
+        # timestep fails, so that they are consistent with the rasters written up to that timestep
+        try:
+            Writers.close()
+        finally:
+            if Manifest is not None:
+                Manifest.save()
+            for Stack in Stacks:
+                Stack.close()
+                print('Write to :', os.path.basename(Stack.path))
+    if (Envelope is not None or Stats is not None) and not os.path.exists(SUMMARY_DIR_PATH):
+        os.makedirs(SUMMARY_DIR_PATH)
+    if Envelope is not None:
+        SummaryManifest = RasterManifest(SUMMARY_DIR_PATH) if SKIP_UNCHANGED else None
+        Envelope.save(SUMMARY_DIR_PATH, OUTPUT_FORMATS, manifest=SummaryManifest)
+        if SummaryManifest is not None:
+            SummaryManifest.save()
+    if Stats is not None:
+        print('Write to :', os.path.basename(Stats.save(pjoin(SUMMARY_DIR_PATH, 'inundation_stats'))))
 
 except Exception as e:
     print(e)
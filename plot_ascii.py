@@ -1,29 +1,30 @@
 import datetime
 import os
 from os.path import join as pjoin
-import math, numbers
-import decimal
 import pandas as pd
 import numpy as np
-import linecache
 import matplotlib.pyplot as plt
 
+from util.LibRaster import RasterWriterPool, load_raster_template, open_raster_stacks, read_raster, save_grids
+from util.LibTimdep import iter_timesteps
+
 
 def get_water_level_grid(lines):
-    waterLevels = []
+    cells = []
+    levels = []
     for line in lines[0:]:
         if line == '\n':
             break
         v = line.split(',')
         # Get flood level (Elevation)
-        # waterLevels.append('%s %s' % (v[0], v[1]))
+        # levels.append(float(v[1]))
         # Get flood depth (Depth)
-        index = int(v[0]) + 1
-        waterLevels.append('%s %s' % (str(index), v[3]))
-    return waterLevels
+        cells.append(int(v[0]) + 1)
+        levels.append(float(v[3]))
+    return np.array(cells, dtype=np.int64), np.array(levels, dtype=np.float64)
 
 
-def get_esri_grid(water_level_min, waterLevels, boudary, CellMap, gap=30.0, missingVal=-9999):
+def get_esri_grid(water_level_min, waterLevels, Template):
     "Esri GRID format : https://en.wikipedia.org/wiki/Esri_grid"
     "ncols         4"
     "nrows         6"
@@ -38,149 +39,61 @@ def get_esri_grid(water_level_min, waterLevels, boudary, CellMap, gap=30.0, miss
     "88 75 27 9"
     "13 5 1 -9999"
 
-    EsriGrid = []
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-    print('>>>>>  cols: %d, rows: %d' % (cols, rows))
-
-    Grid = [[missingVal for x in range(cols)] for y in range(rows)]
-
-    print(Grid)
-
-    for level in waterLevels:
-        v = level.split()
-        i, j = CellMap[int(v[0])]
-        water_level = round(decimal.Decimal(v[1]), 2)
-        if (i >= cols or j >= rows):
-            print('i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-        if water_level >= water_level_min:
-            # Grid[j][i] = float(v[1])
-            Grid[j][i] = water_level
-
-    print('ncols:', cols)
-    print('nrows:', rows)
-    print('xllcorner:', boudary['long_min'] - gap / 2)
-    print('yllcorner:', boudary['lat_min'] - gap / 2)
-
-    EsriGrid.append('%s\t%s\n' % ('ncols', cols))
-    EsriGrid.append('%s\t%s\n' % ('nrows', rows))
-    EsriGrid.append('%s\t%s\n' % ('xllcorner', boudary['long_min'] - gap / 2))
-    EsriGrid.append('%s\t%s\n' % ('yllcorner', boudary['lat_min'] - gap / 2))
-    EsriGrid.append('%s\t%s\n' % ('cellsize', gap))
-    EsriGrid.append('%s\t%s\n' % ('NODATA_value', missingVal))
-
-    for j in range(0, rows):
-        arr = []
-        for i in range(0, cols):
-            arr.append(Grid[j][i])
-
-        EsriGrid.append('%s\n' % (' '.join(str(x) for x in arr)))
-    return EsriGrid
-
-
-def get_grid_boudary(cadpts_file, gap=250.0):
-    "longitude  -> x : larger value"
-    "latitude   -> y : smaller value"
-
-    long_min = 1000000000.0
-    lat_min = 1000000000.0
-    long_max = 0.0
-    lat_max = 0.0
-
-    with open(cadpts_file) as f:
-        lines = f.readlines()
-        for line in lines:
-            values = line.split()
-            long_min = min(long_min, float(values[1]))
-            lat_min = min(lat_min, float(values[2]))
-
-            long_max = max(long_max, float(values[1]))
-            lat_max = max(lat_max, float(values[2]))
-
-    return {
-        'long_min': long_min,
-        'lat_min': lat_min,
-        'long_max': long_max,
-        'lat_max': lat_max
-    }
-
-
-def get_cell_grid(cadpts_file, boudary, gap=250.0):
-    CellMap = {}
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-
-    with open(cadpts_file) as f:
-        lines = f.readlines()
-        for line in lines:
-            v = line.split()
-            i = int((float(v[1]) - boudary['long_min']) / gap)
-            j = int((float(v[2]) - boudary['lat_min']) / gap)
-            if not isinstance(i, numbers.Integral) or not isinstance(j, numbers.Integral):
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if (i >= cols or j >= rows):
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if i >= 0 or j >= 0:
-                CellMap[int(v[0])] = (i, rows - j - 1)
-
-    return CellMap
+    cells, levels = waterLevels
+    Grid = Template.build_grid(cells, levels, threshold=water_level_min, decimals=2)
+    return Template.format_grid(Grid, decimals=2)
 
 
 def create_multi_ascii(timedep_file, cadpts_file, grid_size, start_date, start_time, water_level_file,
                        water_level_dir_path,
-                 water_level_min):
-    buffer_size = 65536
-
+                 water_level_min, output_formats=('asc',), writer_threads=0):
+    # Raster output formats of util.LibRaster.OUTPUT_FORMATS and STACK_FORMATS. E.g. ('asc', 'tif', 'nc')
+    # With writer_threads, rasters are written in the background while the next timesteps are parsed
     now = datetime.datetime.now()
-    with open(timedep_file) as infile:
-        waterLevelLines = []
-        boundary = get_grid_boudary(cadpts_file, gap=grid_size)
-        CellGrid = get_cell_grid(cadpts_file, boundary, gap=grid_size)
-        while True:
-            lines = infile.readlines(buffer_size)
-            if not lines:
-                break
-            for line in lines:
-                if len(line.split()) == 1:
-                    if len(waterLevelLines) > 0:
-                        waterLevels = get_water_level_grid(waterLevelLines)
-                        EsriGrid = get_esri_grid(water_level_min, waterLevels, boundary, CellGrid, gap=grid_size)
-
-                        # Create Directory
-                        if not os.path.exists(water_level_dir_path):
-                            os.makedirs(water_level_dir_path)
-                        # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
-                        ModelTime = float(waterLevelLines[0].split()[0])
-                        fileModelTime = datetime.datetime.strptime('%s %s' % (start_date, start_time),
-                                                                   '%Y-%m-%d %H:%M:%S')
-                        fileModelTime = fileModelTime + datetime.timedelta(hours=ModelTime)
-                        dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
-                        if fileModelTime >= now:
-                            # Create files
-                            fileName = water_level_file.rsplit('.', 1)
-                            fileName = "%s-%s.%s" % (fileName[0], dateAndTime, fileName[1])
-                            water_level_file_path = pjoin(water_level_dir_path, fileName)
-                            file = open(water_level_file_path, 'w')
-                            file.writelines(EsriGrid)
-                            file.close()
-                            print('Write to :', fileName)
-                        else:
-                            print('Skip. Current model time:' + dateAndTime +
-                                  ' is not greater than ' + now.strftime("%Y-%m-%d_%H-%M-%S"))
-                        waterLevelLines = []
-                waterLevelLines.append(line)
+    Template = load_raster_template(cadpts_file, gap=grid_size)
+    print('create_multi_ascii|Template : ', Template)
+    if not os.path.exists(water_level_dir_path):
+        os.makedirs(water_level_dir_path)
+    stacks = open_raster_stacks(pjoin(water_level_dir_path, water_level_file), Template,
+                                datetime.datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S'),
+                                output_formats)
+    writers = RasterWriterPool(threads=writer_threads)
+    for ModelTime, levels in iter_timesteps(timedep_file, dtype=np.float64):
+        # Cells which are not present in the timestep are NaN
+        cells = np.flatnonzero(~np.isnan(levels))
+        Grid = Template.build_grid(cells, levels[cells], threshold=water_level_min, decimals=2)
+
+        # Create Directory
+        if not os.path.exists(water_level_dir_path):
+            os.makedirs(water_level_dir_path)
+        # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
+        fileModelTime = datetime.datetime.strptime('%s %s' % (start_date, start_time),
+                                                   '%Y-%m-%d %H:%M:%S')
+        fileModelTime = fileModelTime + datetime.timedelta(hours=ModelTime)
+        dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
+        if fileModelTime >= now:
+            # Create files
+            fileName = water_level_file.rsplit('.', 1)
+            fileName = "%s-%s.%s" % (fileName[0], dateAndTime, fileName[1])
+            water_level_file_path = pjoin(water_level_dir_path, fileName)
+            writers.submit(save_grids, water_level_file_path, Grid, Template, output_formats, decimals=2)
+            for stack in stacks:
+                stack.append(ModelTime, Grid)
+        else:
+            print('Skip. Current model time:' + dateAndTime +
+                  ' is not greater than ' + now.strftime("%Y-%m-%d_%H-%M-%S"))
+    writers.close()
+    for stack in stacks:
+        stack.close()
+        print('Write to :', os.path.basename(stack.path))
 
 
 def create_single_ascii(cadpts_file, grid_size, shape_data_file, water_level_dir_path, water_level_min):
     buffer_size = 65536
     with open(shape_data_file) as infile:
         waterLevelLines = []
-        boundary = get_grid_boudary(cadpts_file, gap=grid_size)
-        print('create_single_ascii|boundary : ', boundary)
-        CellGrid = get_cell_grid(cadpts_file, boundary, gap=grid_size)
-        print('create_single_ascii|CellGrid : ', CellGrid)
+        Template = load_raster_template(cadpts_file, gap=grid_size)
+        print('create_single_ascii|Template : ', Template)
         shape_ascii_file = os.path.join(water_level_dir_path, 'max_wl_ascii.asc')
         file = open(shape_ascii_file, 'w')
         while True:
@@ -191,8 +104,8 @@ def create_single_ascii(cadpts_file, grid_size, shape_data_file, water_level_dir
                 waterLevelLines.append(line)
         print('create_single_ascii|len(waterLevelLines) : ', len(waterLevelLines))
         waterLevels = get_water_level_grid(waterLevelLines)
-        print('create_single_ascii|len(waterLevels) : ', len(waterLevels))
-        EsriGrid = get_esri_grid(water_level_min, waterLevels, boundary, CellGrid, gap=grid_size)
+        print('create_single_ascii|len(waterLevels) : ', len(waterLevels[0]))
+        EsriGrid = get_esri_grid(water_level_min, waterLevels, Template)
         print('create_single_ascii|EsriGrid : ', EsriGrid)
         file.writelines(EsriGrid)
         file.close()
@@ -200,14 +113,15 @@ def create_single_ascii(cadpts_file, grid_size, shape_data_file, water_level_dir
 
 
 def create_esri_grid_plot(ascii_file, plot_image_file):
-    ascii_data = np.loadtxt(ascii_file, skiprows=6)
-
-    ncols = int(linecache.getline(ascii_file, 1).split('	')[1])
-    nrows = int(linecache.getline(ascii_file, 2).split('	')[1])
-    xllcorner = float(linecache.getline(ascii_file, 3).split('	')[1])
-    yllcorner = float(linecache.getline(ascii_file, 4).split('	')[1])
-    cellsize = float(linecache.getline(ascii_file, 5).split('	')[1])
-    NODATA_value = float(linecache.getline(ascii_file, 6).split('	')[1])
+    # ASCII grid may be gzip or zstd compressed (.gz or .zst), or an ESRI binary grid (.flt)
+    ascii_data, geotransform, header = read_raster(ascii_file, mmap=False)
+
+    ncols = int(header.get_value('ncols'))
+    nrows = int(header.get_value('nrows'))
+    xllcorner = geotransform[0]
+    yllcorner = geotransform[3] + nrows * geotransform[5]
+    cellsize = geotransform[1]
+    NODATA_value = header.get_value('NODATA_value')
 
     ascii_data[ascii_data == NODATA_value] = np.nan
 
@@ -7,16 +7,22 @@ import os
 import sys
 import traceback
 import copy
+import math
 from datetime import datetime, timedelta
 from os.path import join as pjoin
 
+import numpy as np
 from curwmysqladapter import MySQLAdapter
 
 import Constants
 from LIBFLO2DWATERLEVELGRID import getWaterLevelOfChannels
-from Util.LibForecastTimeseries import extractForecastTimeseries
-from Util.LibForecastTimeseries import extractForecastTimeseriesInDays
-from Util.Utils import getUTCOffset
+from util.LibForecastTimeseries import extractForecastTimeAxis
+from util.LibForecastTimeseries import formatTimeAxis
+from util.LibForecastTimeseries import getTimeAxis
+from util.LibForecastTimeseries import splitTimeAxisInDays
+from util.Utils import getUTCOffset
+from util.LibHychan import load_hychan
+from util.LibTimdep import read_timdep_cells
 
 
 def usage():
@@ -39,37 +45,15 @@ Usage: ./EXTRACTFLO2DTOWATERLEVEL.py [-d YYYY-MM-DD] [-t HH:MM:SS] [-p -o -h] [-
     print(usageText)
 
 
-def get_water_level_of_channels(lines, channels=None):
+def get_timeseries(times, values):
     """
-     Get Water Levels of given set of channels
-    :param lines:
-    :param channels:
-    :return:
+    Zip a datetime64 time axis and values into a timeseries of [date time string, value] for CSV files and the database.
+    Timestamps are formatted in bulk.
     """
-    if channels is None:
-        channels = []
-    water_levels = {}
-    for line in lines[1:]:
-        if line == '\n':
-            break
-        v = line.split()
-        if v[0] in channels:
-            # Get flood level (Elevation)
-            water_levels[v[0]] = v[5]
-            # Get flood depth (Depth)
-            # water_levels[int(v[0])] = v[2]
-    return water_levels
-
-
-def isfloat(value):
-    try:
-        float(value)
-        return True
-    except ValueError:
-        return False
+    return [list(item) for item in zip(formatTimeAxis(times), values)]
 
 
-def save_forecast_timeseries(my_adapter, my_timeseries, my_model_date, my_model_time, my_opts):
+def save_forecast_timeseries(my_adapter, my_times, my_values, my_model_date, my_model_time, my_opts):
     # print('EXTRACTFLO2DWATERLEVEL:: save_forecast_timeseries >>', my_opts)
 
     # Convert date time with offset
@@ -80,19 +64,12 @@ def save_forecast_timeseries(my_adapter, my_timeseries, my_model_date, my_model_
         my_model_time = date_time.strftime('%H:%M:%S')
 
     # If there is an offset, shift by offset before proceed
-    forecast_timeseries = []
     if 'utcOffset' in my_opts:
-        # print('Shit by utcOffset:', my_opts['utcOffset'].resolution)
-        for item in my_timeseries:
-            forecast_timeseries.append(
-                [datetime.strptime(item[0], Constants.COMMON_DATE_TIME_FORMAT) + my_opts['utcOffset'], item[1]])
-
-        forecast_timeseries = extractForecastTimeseries(forecast_timeseries, my_model_date, my_model_time, by_day=True)
-    else:
-        forecast_timeseries = extractForecastTimeseries(my_timeseries, my_model_date, my_model_time, by_day=True)
+        my_times = my_times + np.timedelta64(my_opts['utcOffset'])
 
-    # print(forecast_timeseries[:10])
-    extracted_timeseries = extractForecastTimeseriesInDays(forecast_timeseries)
+    start = extractForecastTimeAxis(my_times, my_model_date, my_model_time, by_day=True)
+    forecast_timeseries = get_timeseries(my_times[start:], my_values[start:])
+    extracted_timeseries = [forecast_timeseries[day] for day in splitTimeAxisInDays(my_times[start:])]
 
     # for ll in extractedTimeseries :
     #     print(ll)
@@ -151,8 +128,8 @@ def save_forecast_timeseries(my_adapter, my_timeseries, my_model_date, my_model_
     ]
     meta_data = {
         'station': station,
-        'variable': 'WaterLevel',
-        'unit': 'm',
+        'variable': my_opts.get('variable', 'WaterLevel'),
+        'unit': my_opts.get('unit', 'm'),
         'type': types[0],
         'source': source,
         'name': run_name
@@ -190,6 +167,13 @@ try:
     HYCHAN_OUT_FILE = 'HYCHAN.OUT'
     TIMEDEP_FILE = 'TIMDEP.OUT'
     WATER_LEVEL_FILE = 'water_level.txt'
+    # Variables of channel hydrographs to publish. Variable -> (HYCHAN.OUT column, unit, output file)
+    CHANNEL_VARIABLES = ['WaterLevel']
+    CHANNEL_VARIABLE_MAP = {
+        'WaterLevel': ('elevation', 'm', WATER_LEVEL_FILE),
+        'Depth': ('depth', 'm', 'depth.txt'),
+        'Discharge': ('discharge', 'm3/s', 'discharge.txt')
+    }
     WATER_LEVEL_DIR = 'water_level'
     OUTPUT_DIR = 'OUTPUT'
     RUN_FLO2D_FILE = 'RUN_FLO2D.json'
@@ -208,6 +192,9 @@ try:
         TIMEDEP_FILE = CONFIG['TIMEDEP_FILE']
     if 'WATER_LEVEL_FILE' in CONFIG:
         WATER_LEVEL_FILE = CONFIG['WATER_LEVEL_FILE']
+        CHANNEL_VARIABLE_MAP['WaterLevel'] = ('elevation', 'm', WATER_LEVEL_FILE)
+    if 'CHANNEL_VARIABLES' in CONFIG:
+        CHANNEL_VARIABLES = CONFIG['CHANNEL_VARIABLES']
     if 'OUTPUT_DIR' in CONFIG:
         OUTPUT_DIR = CONFIG['OUTPUT_DIR']
 
@@ -290,7 +277,6 @@ try:
 
     ELEMENT_NUMBERS = CHANNEL_CELL_MAP.keys()
     FLOOD_ELEMENT_NUMBERS = FLOOD_PLAIN_CELL_MAP.keys()
-    SERIES_LENGTH = 0
     MISSING_VALUE = -999
 
     date = ''
@@ -424,210 +410,90 @@ try:
     if not os.path.exists(OUTPUT_DIR_PATH):
         os.makedirs(OUTPUT_DIR_PATH)
 
-    # Calculate the size of time series
-    bufsize = 65536
-    with open(HYCHAN_OUT_FILE_PATH) as infile:
-        isWaterLevelLines = False
-        isCounting = False
-        countSeriesSize = 0  # HACK: When it comes to the end of file, unable to detect end of time series
-        while True:
-            lines = infile.readlines(bufsize)
-            if not lines or SERIES_LENGTH:
-                break
-            for line in lines:
-                if line.startswith('CHANNEL HYDROGRAPH FOR ELEMENT NO:', 5):
-                    isWaterLevelLines = True
-                elif isWaterLevelLines:
-                    cols = line.split()
-                    if len(cols) > 0 and cols[0].replace('.', '', 1).isdigit():
-                        countSeriesSize += 1
-                        isCounting = True
-                    elif isWaterLevelLines and isCounting:
-                        SERIES_LENGTH = countSeriesSize
-                        break
-
-    print('Series Length is :', SERIES_LENGTH)
-    bufsize = 65536
     #################################################################
-    # Extract Channel Water Level elevations from HYCHAN.OUT file   #
+    # Extract Channel hydrograph variables from HYCHAN.OUT file     #
     #################################################################
     print('Extract Channel Water Level Result of FLO2D HYCHAN.OUT on', date, '@', time, 'with Bast time of', start_date,
           '@', start_time)
-    with open(HYCHAN_OUT_FILE_PATH) as infile:
-        isWaterLevelLines = False
-        isSeriesComplete = False
-        waterLevelLines = []
-        seriesSize = 0  # HACK: When it comes to the end of file, unable to detect end of time series
-        while True:
-            lines = infile.readlines(bufsize)
-            if not lines:
-                break
-            for line in lines:
-                if line.startswith('CHANNEL HYDROGRAPH FOR ELEMENT NO:', 5):
-                    seriesSize = 0
-                    elementNo = line.split()[5]
-
-                    if elementNo in ELEMENT_NUMBERS:
-                        isWaterLevelLines = True
-                        waterLevelLines.append(line)
-                    else:
-                        isWaterLevelLines = False
-
-                elif isWaterLevelLines:
-                    cols = line.split()
-                    if len(cols) > 0 and isfloat(cols[0]):
-                        seriesSize += 1
-                        waterLevelLines.append(line)
-
-                        if seriesSize == SERIES_LENGTH:
-                            isSeriesComplete = True
-
-                if isSeriesComplete:
-                    baseTime = datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
-                    timeseries = []
-                    elementNo = waterLevelLines[0].split()[5]
-                    # print('Extracted Cell No', elementNo, CHANNEL_CELL_MAP[elementNo])
-                    for ts in waterLevelLines[1:]:
-                        v = ts.split()
-                        if len(v) < 1:
-                            continue
-                        # Get flood level (Elevation)
-                        value = v[1]
-                        # Get flood depth (Depth)
-                        # value = v[2]
-                        if not isfloat(value):
-                            value = MISSING_VALUE
-                            continue  # If value is not present, skip
-                        if value == 'NaN':
-                            continue  # If value is NaN, skip
-                        timeStep = float(v[0])
-                        currentStepTime = baseTime + timedelta(hours=timeStep)
-                        dateAndTime = currentStepTime.strftime("%Y-%m-%d %H:%M:%S")
-                        timeseries.append([dateAndTime, value])
-
-                    # Create Directory
-                    if not os.path.exists(WATER_LEVEL_DIR_PATH):
-                        os.makedirs(WATER_LEVEL_DIR_PATH)
-                    # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
-                    ModelTime = float(waterLevelLines[1].split()[3])
-                    fileModelTime = datetime.strptime(date, '%Y-%m-%d')
-                    fileModelTime = fileModelTime + timedelta(hours=ModelTime)
-                    dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
-                    # Create files
-                    fileName = WATER_LEVEL_FILE.rsplit('.', 1)
-                    stationName = CHANNEL_CELL_MAP[elementNo].replace(' ', '_')
-                    fileTimestamp = "%s_%s" % (date, time.replace(':', '-'))
-                    fileName = "%s-%s-%s.%s" % (fileName[0], stationName, fileTimestamp, fileName[1])
-                    WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
-                    csvWriter = csv.writer(open(WATER_LEVEL_FILE_PATH, 'w'), delimiter=',', quotechar='|')
-                    csvWriter.writerows(timeseries)
-                    # Save Forecast values into Database
-                    opts = {
-                        'forceInsert': forceInsert,
-                        'station': CHANNEL_CELL_MAP[elementNo],
-                        'run_name': runName
-                    }
-                    # print('>>>>>', opts)
-                    if utcOffset != timedelta():
-                        opts['utcOffset'] = utcOffset
-                    save_forecast_timeseries(adapter, timeseries, date, time, opts)
-
-                    isWaterLevelLines = False
-                    isSeriesComplete = False
-                    waterLevelLines = []
-            # -- END for loop
-        # -- END while loop
+    baseTime = datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
+    # All the variables are taken from the same read of each hydrograph
+    for elementNo, hydrograph in load_hychan(HYCHAN_OUT_FILE_PATH, elements=ELEMENT_NUMBERS).items():
+        # print('Extracted Cell No', elementNo, CHANNEL_CELL_MAP[elementNo])
+        for variable in CHANNEL_VARIABLES:
+            column, unit, variableFile = CHANNEL_VARIABLE_MAP[variable]
+            isPresent = ~np.isnan(hydrograph[column])  # If value is not present or NaN, skip
+            times = getTimeAxis(baseTime, hydrograph['time'][isPresent])
+            values = hydrograph[column][isPresent].tolist()
 
-    #################################################################
-    # Extract Flood Plain water elevations from BASE.OUT file       #
-    #################################################################
-    print('appDir : ', appDir)
-    TIMEDEP_FILE_PATH = pjoin(appDir, TIMEDEP_FILE)
-    print('TIMEDEP_FILE_PATH : ', TIMEDEP_FILE_PATH)
-    print('Extract Flood Plain Water Level Result of FLO2D on', date, '@', time, 'with Bast time of', start_date, '@',
-          start_time)
-    with open(TIMEDEP_FILE_PATH) as infile:
-        waterLevelLines = []
-        waterLevelSeriesDict = dict.fromkeys(FLOOD_ELEMENT_NUMBERS, [])
-        while True:
-            lines = infile.readlines(bufsize)
-            if not lines:
-                break
-            for line in lines:
-                if len(line.split()) == 1:
-                    if len(waterLevelLines) > 0:
-                        waterLevels = get_water_level_of_channels(waterLevelLines, FLOOD_ELEMENT_NUMBERS)
-                        # Create Directory
-                        if not os.path.exists(WATER_LEVEL_DIR_PATH):
-                            os.makedirs(WATER_LEVEL_DIR_PATH)
-                        # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
-                        # print(waterLevelLines[0].split())
-                        ModelTime = float(waterLevelLines[0].split()[0])
-                        baseTime = datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
-                        currentStepTime = baseTime + timedelta(hours=ModelTime)
-                        dateAndTime = currentStepTime.strftime("%Y-%m-%d %H:%M:%S")
-
-                        for elementNo in FLOOD_ELEMENT_NUMBERS:
-                            tmpTS = waterLevelSeriesDict[elementNo][:]
-                            if elementNo in waterLevels:
-                                tmpTS.append([dateAndTime, waterLevels[elementNo]])
-                            else:
-                                tmpTS.append([dateAndTime, MISSING_VALUE])
-                            waterLevelSeriesDict[elementNo] = tmpTS
-
-                        isWaterLevelLines = False
-                        # for l in waterLevelLines :
-                        # print(l)
-                        waterLevelLines = []
-                waterLevelLines.append(line)
-        if len(waterLevelLines) > 0:
-            waterLevels = get_water_level_of_channels(waterLevelLines, FLOOD_ELEMENT_NUMBERS)
             # Create Directory
             if not os.path.exists(WATER_LEVEL_DIR_PATH):
                 os.makedirs(WATER_LEVEL_DIR_PATH)
-            # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
-            # print(waterLevelLines[0].split())
-            ModelTime = float(waterLevelLines[0].split()[0])
-            baseTime = datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
-            currentStepTime = baseTime + timedelta(hours=ModelTime)
-            dateAndTime = currentStepTime.strftime("%Y-%m-%d %H:%M:%S")
-
-            for elementNo in FLOOD_ELEMENT_NUMBERS:
-                tmpTS = waterLevelSeriesDict[elementNo][:]
-                if elementNo in waterLevels:
-                    tmpTS.append([dateAndTime, waterLevels[elementNo]])
-                else:
-                    tmpTS.append([dateAndTime, MISSING_VALUE])
-                waterLevelSeriesDict[elementNo] = tmpTS
-
-            isWaterLevelLines = False
-            # for l in waterLevelLines :
-            # print(l)
-            waterLevelLines = []
-        # Create files
-        print('WATER_LEVEL_DIR_PATH : ', WATER_LEVEL_DIR_PATH)
-        print('len(FLOOD_ELEMENT_NUMBERS) : ', len(FLOOD_ELEMENT_NUMBERS))
-        for elementNo in FLOOD_ELEMENT_NUMBERS:
-            fileName = WATER_LEVEL_FILE.rsplit('.', 1)
-            stationName = FLOOD_PLAIN_CELL_MAP[elementNo].replace(' ', '_')
+            # Create files
+            fileName = variableFile.rsplit('.', 1)
+            stationName = CHANNEL_CELL_MAP[elementNo].replace(' ', '_')
             fileTimestamp = "%s_%s" % (date, time.replace(':', '-'))
-            fileName = "%s-%s-%s.%s" % \
-                       (fileName[0], FLOOD_PLAIN_CELL_MAP[elementNo].replace(' ', '_'), fileTimestamp, fileName[1])
+            fileName = "%s-%s-%s.%s" % (fileName[0], stationName, fileTimestamp, fileName[1])
             WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
-            # print('WATER_LEVEL_FILE_PATH : ',WATER_LEVEL_FILE_PATH)
             csvWriter = csv.writer(open(WATER_LEVEL_FILE_PATH, 'w'), delimiter=',', quotechar='|')
-            csvWriter.writerows(waterLevelSeriesDict[elementNo])
+            csvWriter.writerows(get_timeseries(times, values))
             # Save Forecast values into Database
             opts = {
                 'forceInsert': forceInsert,
-                'station': FLOOD_PLAIN_CELL_MAP[elementNo],
+                'station': CHANNEL_CELL_MAP[elementNo],
                 'run_name': runName,
-                'source': FLO2D_MODEL
+                'variable': variable,
+                'unit': unit
             }
+            # print('>>>>>', opts)
             if utcOffset != timedelta():
                 opts['utcOffset'] = utcOffset
-            save_forecast_timeseries(adapter, waterLevelSeriesDict[elementNo], date, time, opts)
-            # print('Extracted Cell No', elementNo, FLOOD_PLAIN_CELL_MAP[elementNo], 'into -> ', fileName)
+            save_forecast_timeseries(adapter, times, values, date, time, opts)
+
+    #################################################################
+    # Extract Flood Plain water elevations from BASE.OUT file       #
+    #################################################################
+    print('appDir : ', appDir)
+    TIMEDEP_FILE_PATH = pjoin(appDir, TIMEDEP_FILE)
+    print('TIMEDEP_FILE_PATH : ', TIMEDEP_FILE_PATH)
+    print('Extract Flood Plain Water Level Result of FLO2D on', date, '@', time, 'with Bast time of', start_date, '@',
+          start_time)
+    baseTime = datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
+    # Read the series of the flood plain cells into preallocated arrays. Column 5 is the water surface elevation.
+    floodCells = [int(elementNo) for elementNo in FLOOD_ELEMENT_NUMBERS]
+    modelTimes, floodLevels = read_timdep_cells(TIMEDEP_FILE_PATH, floodCells, column=5, dtype=np.float64)
+    # Create Directory
+    if len(modelTimes) and not os.path.exists(WATER_LEVEL_DIR_PATH):
+        os.makedirs(WATER_LEVEL_DIR_PATH)
+    floodTimes = getTimeAxis(baseTime, modelTimes)
+    waterLevelSeriesDict = {}
+    for k, elementNo in enumerate(FLOOD_ELEMENT_NUMBERS):
+        waterLevelSeriesDict[elementNo] = [MISSING_VALUE if math.isnan(value) else value
+                                           for value in floodLevels[:, k].tolist()]
+
+    # Create files
+    print('WATER_LEVEL_DIR_PATH : ', WATER_LEVEL_DIR_PATH)
+    print('len(FLOOD_ELEMENT_NUMBERS) : ', len(FLOOD_ELEMENT_NUMBERS))
+    for elementNo in FLOOD_ELEMENT_NUMBERS:
+        fileName = WATER_LEVEL_FILE.rsplit('.', 1)
+        stationName = FLOOD_PLAIN_CELL_MAP[elementNo].replace(' ', '_')
+        fileTimestamp = "%s_%s" % (date, time.replace(':', '-'))
+        fileName = "%s-%s-%s.%s" % \
+                   (fileName[0], FLOOD_PLAIN_CELL_MAP[elementNo].replace(' ', '_'), fileTimestamp, fileName[1])
+        WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
+        # print('WATER_LEVEL_FILE_PATH : ',WATER_LEVEL_FILE_PATH)
+        csvWriter = csv.writer(open(WATER_LEVEL_FILE_PATH, 'w'), delimiter=',', quotechar='|')
+        csvWriter.writerows(get_timeseries(floodTimes, waterLevelSeriesDict[elementNo]))
+        # Save Forecast values into Database
+        opts = {
+            'forceInsert': forceInsert,
+            'station': FLOOD_PLAIN_CELL_MAP[elementNo],
+            'run_name': runName,
+            'source': FLO2D_MODEL
+        }
+        if utcOffset != timedelta():
+            opts['utcOffset'] = utcOffset
+        save_forecast_timeseries(adapter, floodTimes, waterLevelSeriesDict[elementNo], date, time, opts)
+        # print('Extracted Cell No', elementNo, FLOOD_PLAIN_CELL_MAP[elementNo], 'into -> ', fileName)
 
 except Exception as e:
     traceback.print_exc()
@@ -8,8 +8,10 @@ import sys
 import traceback
 import pandas as pd
 from os.path import join as pjoin
-import math, numbers
-import decimal
+
+import numpy as np
+
+from util.LibRaster import load_raster_template
 
 
 def usage():
@@ -31,20 +33,21 @@ Usage: ./FLO2DTOLEVELGRID_GEN.py [-d YYYY-MM-DD] [-t HH:MM:SS] [-p -o -h] [-S YY
 
 
 def get_water_level_grid(lines):
-    waterLevels = []
+    cells = []
+    levels = []
     for line in lines[0:]:
         if line == '\n':
             break
         v = line.split(',')
         # Get flood level (Elevation)
-        # waterLevels.append('%s %s' % (v[0], v[1]))
+        # levels.append(float(v[1]))
         # Get flood depth (Depth)
-        index = int(v[0])+1
-        waterLevels.append('%s %s' % (str(index), v[3]))
-    return waterLevels
+        cells.append(int(v[0]) + 1)
+        levels.append(float(v[3]))
+    return np.array(cells, dtype=np.int64), np.array(levels, dtype=np.float64)
 
 
-def get_esri_grid(waterLevels, boudary, CellMap, gap=30.0, missingVal=-9999):
+def get_esri_grid(waterLevels, Template):
     "Esri GRID format : https://en.wikipedia.org/wiki/Esri_grid"
     "ncols         4"
     "nrows         6"
@@ -59,103 +62,9 @@ def get_esri_grid(waterLevels, boudary, CellMap, gap=30.0, missingVal=-9999):
     "88 75 27 9"
     "13 5 1 -9999"
 
-    EsriGrid = []
-
-    #For Niluka
-    # ncols:492
-    #nrows:533
-    #xllcorner:396935.00000
-    #yllcorner:482565.00000
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    # cols = 492
-    rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-    # rows = 533
-    print('>>>>>  cols: %d, rows: %d' % (cols, rows))
-
-    Grid = [[missingVal for x in range(cols)] for y in range(rows)]
-
-    print(Grid)
-
-    for level in waterLevels :
-        v = level.split()
-        i, j = CellMap[int(v[0])]
-        water_level = round(decimal.Decimal(v[1]), 2)
-        if (i >= cols or j >= rows) :
-            print('i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-        if water_level >= WATER_LEVEL_DEPTH_MIN:
-            #Grid[j][i] = float(v[1])
-            Grid[j][i] = water_level
-
-    print('ncols:', cols)
-    print('nrows:', rows)
-    print('xllcorner:',boudary['long_min'] - gap/2)
-    print('yllcorner:',boudary['lat_min'] - gap/2)
-
-    EsriGrid.append('%s\t%s\n' % ('ncols', cols))
-    EsriGrid.append('%s\t%s\n' % ('nrows', rows))
-    EsriGrid.append('%s\t%s\n' % ('xllcorner', boudary['long_min'] - gap/2))
-    EsriGrid.append('%s\t%s\n' % ('yllcorner', boudary['lat_min'] - gap/2))
-    EsriGrid.append('%s\t%s\n' % ('cellsize', gap))
-    EsriGrid.append('%s\t%s\n' % ('NODATA_value', missingVal))
-
-    for j in range(0, rows) :
-        arr = []
-        for i in range(0, cols) :
-            arr.append(Grid[j][i])
-
-        EsriGrid.append('%s\n' % (' '.join(str(x) for x in arr)))
-    return EsriGrid
-
-
-def get_grid_boudary(gap=30.0):
-    "longitude  -> x : larger value"
-    "latitude   -> y : smaller value"
-
-    long_min = 1000000000.0
-    lat_min = 1000000000.0
-    long_max = 0.0
-    lat_max = 0.0
-
-    with open(CADPTS_DAT_FILE) as f:
-        lines = f.readlines()
-        for line in lines :
-            values = line.split()
-            long_min = min(long_min, float(values[1]))
-            lat_min = min(lat_min, float(values[2]))
-
-            long_max = max(long_max, float(values[1]))
-            lat_max = max(lat_max, float(values[2]))
-
-    return {
-        'long_min': long_min,
-        'lat_min': lat_min,
-        'long_max': long_max,
-        'lat_max': lat_max
-    }
-
-
-def get_cell_grid(boudary, gap=30.0):
-    CellMap = {}
-
-    cols = int(math.ceil((boudary['long_max'] - boudary['long_min']) / gap)) + 1
-    rows = int(math.ceil((boudary['lat_max'] - boudary['lat_min']) / gap)) + 1
-
-    with open(CADPTS_DAT_FILE) as f:
-        lines = f.readlines()
-        for line in lines :
-            v = line.split()
-            i = int((float(v[1]) - boudary['long_min']) / gap)
-            j = int((float(v[2]) - boudary['lat_min']) / gap)
-            if not isinstance(i, numbers.Integral) or not isinstance(j, numbers.Integral) :
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if (i >= cols or j >= rows) :
-                print('### WARNING i: %d, j: %d, cols: %d, rows: %d' % (i, j, cols, rows))
-            if i >= 0 or j >= 0 :
-                CellMap[int(v[0])] = (i, rows - j -1)
-
-    print(CellMap)
-    return CellMap
+    cells, levels = waterLevels
+    Grid = Template.build_grid(cells, levels, threshold=WATER_LEVEL_DEPTH_MIN, decimals=2)
+    return Template.format_grid(Grid, decimals=2)
 
 
 def read_input(input_path):
@@ -266,8 +175,8 @@ try:
 
     with open(SHAPE_DATA_FILE) as infile:
         waterLevelLines = []
-        boundary = get_grid_boudary(gap=GRID_SIZE)
-        CellGrid = get_cell_grid(boundary, gap=GRID_SIZE)
+        Template = load_raster_template(CADPTS_DAT_FILE, gap=GRID_SIZE)
+        print('Raster template :', Template)
         file = open(SHAPE_ASC_FILE, 'w')
         while True:
             lines = infile.readlines(buffer_size)
@@ -276,7 +185,7 @@ try:
             for line in lines:
                 waterLevelLines.append(line)
         waterLevels = get_water_level_grid(waterLevelLines)
-        EsriGrid = get_esri_grid(waterLevels, boundary, CellGrid, gap=GRID_SIZE)
+        EsriGrid = get_esri_grid(waterLevels, Template)
         file.writelines(EsriGrid)
         file.close()
 except Exception as e:
@@ -1,7 +1,16 @@
 import getopt
 import sys
 import numpy as np
-import linecache
+
+from util.LibRasterAlgebra import evaluate_rasters
+
+
+def subtract(grids):
+    # NODATA cells are 0.00. Cells with the same value in both grids are NODATA
+    result_grid = np.subtract(grids[0], grids[1])
+    result_grid[result_grid == 0.00] = np.nan
+    return result_grid
+
 
 try:
     FIRST_ASCII_FILE_PATH = 'input/case1.asc'
@@ -18,26 +27,13 @@ try:
         sys.exit(2)
     for opt, arg in opts:
         if opt in ("-f", "--first"):
-            FIRST_ASCII_FILE_PATH = float(arg)
+            FIRST_ASCII_FILE_PATH = arg
         elif opt in ("-s", "--second"):
-            SECOND_ASCII_FILE_PATH = float(arg)
+            SECOND_ASCII_FILE_PATH = arg
     print('{FIRST_ASCII_FILE_PATH, SECOND_ASCII_FILE_PATH}: ', {FIRST_ASCII_FILE_PATH, SECOND_ASCII_FILE_PATH})
-    ascii_grid1 = np.loadtxt(FIRST_ASCII_FILE_PATH, skiprows=6)
-    ascii_grid2 = np.loadtxt(SECOND_ASCII_FILE_PATH, skiprows=6)
-    ascii1_line1 = linecache.getline(FIRST_ASCII_FILE_PATH, 1)
-    ascii1_line2 = linecache.getline(FIRST_ASCII_FILE_PATH, 2)
-    ascii1_line3 = linecache.getline(FIRST_ASCII_FILE_PATH, 3)
-    ascii1_line4 = linecache.getline(FIRST_ASCII_FILE_PATH, 4)
-    ascii1_line5 = linecache.getline(FIRST_ASCII_FILE_PATH, 5)
-    ascii1_line6 = linecache.getline(FIRST_ASCII_FILE_PATH, 6)
-    ascii_grid1[ascii_grid1 == -9999] = 0.00
-    ascii_grid2[ascii_grid2 == -9999] = 0.00
-    result_grid = ascii_grid1 - ascii_grid2
-    result_grid = np.subtract(ascii_grid1, ascii_grid2)
-    result_grid[result_grid == 0.00] = -9999
-    print(result_grid)
-    header = ascii1_line1 + ascii1_line2 + ascii1_line3 + ascii1_line4 + ascii1_line5 + ascii1_line6.strip()
-    print(header)
-    np.savetxt(RESULT_ASCII_FILE_PATH, result_grid, header=header, fmt="%1.2f", comments='')
+    # ASCII grids may be gzip or zstd compressed (.gz or .zst), or ESRI binary grids (.flt)
+    evaluate_rasters([FIRST_ASCII_FILE_PATH, SECOND_ASCII_FILE_PATH], subtract, RESULT_ASCII_FILE_PATH, fill=0.00,
+                     decimals=2)
+    print('Write to :', RESULT_ASCII_FILE_PATH)
 except Exception as e:
     print("Subtracting ascii file exception|e : ", e)
@@ -1,13 +1,15 @@
 import getopt
 import sys
 
+from util.LibTimdep import get_timestep_index, select_timesteps
+
 try:
     buf_size = 65536
     TIMEDEP_FILE_PATH = 'TIMDEP.OUT'
     TIMEDEP_S_FILE_PATH = 'TIMDEP_S.OUT'
     START_HOUR = 12.00
     END_HOUR = 24.00
-    output_file = open(TIMEDEP_S_FILE_PATH, 'w')
+    output_file = open(TIMEDEP_S_FILE_PATH, 'wb')
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], "s:e:",
@@ -23,24 +25,12 @@ try:
         elif opt in ("-e", "--end"):
             END_HOUR = float(arg)
     print('{START_HOUR, END_HOUR}: ', {START_HOUR, END_HOUR})
-    with open(TIMEDEP_FILE_PATH) as infile:
-        while True:
-            lines = infile.readlines(buf_size)
-            if not lines:
-                break
-            for line in lines:
-                numbers = line.split('       ')
-                # print(numbers)
-                if (len(numbers) == 1):
-                    hour = float(line.strip())
-                    if (hour >= START_HOUR and hour <= END_HOUR):
-                        write = True
-                    else:
-                        write = False
-                if write:
-                    if (len(numbers) == 1):
-                        print(line)
-                    output_file.writelines(line)
+    # Seek straight to the selected timesteps with the sidecar index, instead of scanning the whole file
+    with open(TIMEDEP_FILE_PATH, 'rb') as infile:
+        for timestep in select_timesteps(get_timestep_index(TIMEDEP_FILE_PATH), START_HOUR, END_HOUR):
+            print(timestep[0])
+            infile.seek(timestep[1])
+            output_file.write(infile.read(timestep[2]))
 
     output_file.close()
 except Exception as e:
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from util.Utils import getFileFingerprint
+
+CACHE_DIR = os.environ.get('FLO2D_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'flo2d'))
+CACHE_SIZE_LIMIT = int(os.environ.get('FLO2D_CACHE_SIZE_LIMIT', 8 * 1024 ** 3))
+MANIFEST_FILE = 'manifest.json'
+
+
+def get_cache_key(path, kind, version, params=None):
+    """
+    Get the cache key of parsed data of a model output file.
+    The key changes when the file is rewritten, or the parser or its parameters change.
+
+    :param string path: Model output file path. E.g. TIMDEP.OUT
+    :param string kind: Name of the parsed data. E.g. 'timdep'
+    :param int version: Version of the parser, which should be increased whenever its output changes
+    :param dict params: Parser parameters
+    :return: hex digest
+    """
+    key = {
+        'path': os.path.abspath(path),
+        'fingerprint': getFileFingerprint(path),
+        'kind': kind,
+        'version': version,
+        'params': params or {}
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_cache(key, cache_dir=None):
+    """
+    Load cached arrays as read only memory maps.
+
+    :return: tuple or dict of arrays as saved, or None if not cached
+    """
+    entry_dir = os.path.join(cache_dir or CACHE_DIR, key)
+    try:
+        with open(os.path.join(entry_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        arrays = {name: np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode='r', allow_pickle=False)
+                  for name in manifest['names']}
+    except (OSError, ValueError, KeyError):
+        return None
+    # Mark as recently used for the LRU eviction. Read only or shared cache directories are still used as they are
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+    if manifest.get('tuple'):
+        return tuple(arrays[name] for name in manifest['names'])
+    return arrays
+
+
+def open_cache_entry(cache_dir=None):
+    """
+    Create a temporary directory to write the .npy files of a new cache entry into. Arrays larger than memory can be
+    written there with numpy.lib.format.open_memmap, before the entry is committed with commit_cache_entry.
+
+    :param string cache_dir: Cache directory. Default is CACHE_DIR
+    :return: temporary directory path, or None if the cache directory is not writable
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        return tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+    except OSError as e:
+        print('Unable to create cache entry in', cache_dir, ':', e)
+        return None
+
+
+def commit_cache_entry(key, tmp_dir, names, is_tuple=True, cache_dir=None, size_limit=None):
+    """
+    Publish a cache entry written into a directory from open_cache_entry. The directory is renamed into place, so
+    that concurrent readers never see a partial entry.
+
+    :param string key: Cache key from get_cache_key
+    :param string tmp_dir: Directory from open_cache_entry which contains <name>.npy for each name
+    :param list names: Array names in order
+    :param boolean is_tuple: Whether load_cache should return a tuple rather than a dict
+    :param string cache_dir: Cache directory. Default is CACHE_DIR
+    :param int size_limit: Evict least recently used entries until the cache is smaller than this many bytes
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    try:
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump({'names': list(names), 'tuple': is_tuple}, f)
+        entry_dir = os.path.join(cache_dir, key)
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(tmp_dir, entry_dir)
+    except OSError as e:
+        print('Unable to save cache', key, ':', e)
+        discard_cache_entry(tmp_dir)
+        return
+    # The new entry is kept even if it is the oldest or larger than the limit, since the caller is about to load it
+    evict_cache(cache_dir, size_limit, keep=[key])
+
+
+def discard_cache_entry(tmp_dir):
+    """
+    Remove a cache entry directory from open_cache_entry which is not going to be committed.
+    """
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def save_cache(key, data, cache_dir=None, size_limit=None):
+    """
+    Save arrays into the cache.
+
+    :param string key: Cache key from get_cache_key
+    :param data: tuple or dict of numpy arrays
+    :param string cache_dir: Cache directory. Default is CACHE_DIR
+    :param int size_limit: Evict least recently used entries until the cache is smaller than this many bytes
+    """
+    is_tuple = isinstance(data, (tuple, list))
+    arrays = {str(k): v for k, v in enumerate(data)} if is_tuple else data
+    tmp_dir = open_cache_entry(cache_dir)
+    if tmp_dir is None:
+        return
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), np.asarray(array), allow_pickle=False)
+    except OSError as e:
+        print('Unable to save cache', key, ':', e)
+        discard_cache_entry(tmp_dir)
+        return
+    commit_cache_entry(key, tmp_dir, arrays.keys(), is_tuple, cache_dir, size_limit)
+
+
+def evict_cache(cache_dir=None, size_limit=None, keep=()):
+    """
+    Remove least recently used cache entries until the total size of the cache is within the size limit.
+
+    :param string cache_dir: Cache directory. Default is CACHE_DIR
+    :param int size_limit: Size limit in bytes. Default is CACHE_SIZE_LIMIT
+    :param keep: Cache keys which are never removed
+    :return: list of removed cache keys
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    size_limit = CACHE_SIZE_LIMIT if size_limit is None else size_limit
+    entries = []
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        if key.startswith('.') or not os.path.isdir(entry_dir):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+        entries.append((os.path.getmtime(entry_dir), size, key))
+
+    total = sum(e[1] for e in entries)
+    removed = []
+    for mtime, size, key in sorted(entries):
+        if total <= size_limit:
+            break
+        if key in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
+        removed.append(key)
+    return removed
+
+
+def get_cached(path, kind, version, loader, cache_dir=None, size_limit=None, **params):
+    """
+    Get parsed data of a model output file from the cache, or parse it with the loader and cache the result.
+    E.g. get_cached('TIMDEP.OUT', 'timdep', 1, read_timdep, column=1)
+
+    :param string path: Model output file path
+    :param string kind: Name of the parsed data
+    :param int version: Version of the parser
+    :param loader: Function called as loader(path, **params) which returns a tuple or dict of numpy arrays
+    :param string cache_dir: Cache directory. Default is CACHE_DIR
+    :param int size_limit: Cache size limit in bytes. Default is CACHE_SIZE_LIMIT
+    :return: tuple or dict of arrays. Cached arrays are read only memory maps
+    """
+    key = get_cache_key(path, kind, version, params)
+    data = load_cache(key, cache_dir)
+    if data is None:
+        data = loader(path, **params)
+        save_cache(key, data, cache_dir, size_limit)
+    return data
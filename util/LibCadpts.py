@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+
+import math
+
+import numpy as np
+
+
+def read_cadpts(path):
+    """
+    Read the grid element coordinates of a FLO2D CADPTS.DAT file in bulk.
+
+    :param string path: CADPTS.DAT file path
+    :return: (cell ids, x, y) numpy arrays
+    """
+    with open(path, 'rb') as f:
+        buf = f.read().strip()
+    if not buf:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    ncols = len(buf[:buf.find(b'\n')].split()) if b'\n' in buf else len(buf.split())
+    table = np.array(buf.split(), dtype=np.float64).reshape(-1, ncols)
+    return table[:, 0].astype(np.int64), table[:, 1], table[:, 2]
+
+
+def get_cell_index(path, gap=250.0):
+    """
+    Compute the grid boundary and the row and column of each cell of CADPTS.DAT for given grid size.
+    Rows are counted from the top, as in ESRI ASCII grids.
+
+    :param string path: CADPTS.DAT file path
+    :param float gap: Grid cell size
+    :return: dict of 'boundary' [long_min, lat_min, long_max, lat_max], and dense 'rows' and 'cols' arrays indexed by
+    cell id, which are -1 for cell ids not in the file
+    """
+    cells, x, y = read_cadpts(path)
+    # Same initial bounds as the grid scripts used
+    long_min = min(1000000000.0, x.min()) if len(x) else 1000000000.0
+    lat_min = min(1000000000.0, y.min()) if len(y) else 1000000000.0
+    long_max = max(0.0, x.max()) if len(x) else 0.0
+    lat_max = max(0.0, y.max()) if len(y) else 0.0
+
+    nrows = int(math.ceil((lat_max - lat_min) / gap)) + 1
+    i = ((x - long_min) / gap).astype(np.int64)
+    j = ((y - lat_min) / gap).astype(np.int64)
+    valid = (i >= 0) | (j >= 0)
+
+    size = cells.max() + 1 if len(cells) else 0
+    rows = np.full(size, -1, dtype=np.int64)
+    cols = np.full(size, -1, dtype=np.int64)
+    rows[cells[valid]] = nrows - j[valid] - 1
+    cols[cells[valid]] = i[valid]
+    return {
+        'boundary': np.array([long_min, lat_min, long_max, lat_max], dtype=np.float64),
+        'rows': rows,
+        'cols': cols
+    }
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+import os
+
+import numpy as np
+
+from util.LibRaster import save_grids
+
+# File name and description of each envelope raster. Times are model hours since the base time
+ENVELOPE_RASTERS = {
+    'max_depth': 'Maximum water depth',
+    'max_depth_time': 'Model hour at which the maximum depth is first reached',
+    'first_wet_time': 'Model hour at which the cell first becomes wet',
+    'wet_duration': 'Number of hours the cell is wet'
+}
+
+
+class FloodEnvelope(object):
+    """
+    Running flood envelope of the timestep grids of a model run, which is updated in place with each timestep so that
+    memory stays proportional to the number of cells. Cells which are not NaN (and at least the threshold, if given)
+    are wet. A wet cell is counted as wet for the whole interval since the previous timestep.
+    E.g. envelope = FloodEnvelope(template)
+         for hour, grid in timesteps:
+             envelope.update(hour, grid)
+         envelope.save(directory, ['asc'])
+    """
+
+    def __init__(self, template, threshold=None):
+        """
+        :param RasterTemplate template: util.LibRaster.RasterTemplate of the grids
+        :param float threshold: Minimum depth of wet cells. Default is any value which is not NaN
+        """
+        self.template = template
+        self.threshold = threshold
+        shape = (template.nrows, template.ncols)
+        self.max_depth = np.full(shape, np.nan, dtype=np.float32)
+        self.max_depth_time = np.full(shape, np.nan, dtype=np.float64)
+        self.first_wet_time = np.full(shape, np.nan, dtype=np.float64)
+        self.wet_duration = np.zeros(shape, dtype=np.float64)
+        self.hour = None
+
+    def update(self, hour, grid):
+        """
+        Update the envelope with the grid of the next timestep.
+
+        :param float hour: Model hour of the timestep, which is after the previous timestep
+        :param grid: nrows x ncols array with NaN as NODATA
+        """
+        with np.errstate(invalid='ignore'):
+            wet = ~np.isnan(grid) if self.threshold is None else grid >= self.threshold
+            # Comparisons with NaN are False, so that cells which were not wet before are also higher
+            higher = wet & ~(grid <= self.max_depth)
+        np.copyto(self.max_depth, grid, where=higher)
+        self.max_depth_time[higher] = hour
+        self.first_wet_time[wet & np.isnan(self.first_wet_time)] = hour
+        if self.hour is not None:
+            self.wet_duration[wet] += hour - self.hour
+        self.hour = hour
+
+    def get_grids(self):
+        """
+        :return: dict of ENVELOPE_RASTERS names and grids, which are NaN for cells which were never wet
+        """
+        dry = np.isnan(self.first_wet_time)
+        wet_duration = self.wet_duration.copy()
+        wet_duration[dry] = np.nan
+        return {
+            'max_depth': self.max_depth,
+            'max_depth_time': self.max_depth_time,
+            'first_wet_time': self.first_wet_time,
+            'wet_duration': wet_duration
+        }
+
+    def save(self, directory, output_formats, decimals=3, trim=True, manifest=None):
+        """
+        Save the envelope rasters as <name>.asc etc. into the directory.
+
+        :param list output_formats: Output formats of util.LibRaster.OUTPUT_FORMATS
+        :param RasterManifest manifest: If given, files which already have the same content are not written again
+        :return: list of paths of the written files
+        """
+        paths = []
+        for name, grid in self.get_grids().items():
+            paths.extend(save_grids(os.path.join(directory, '%s.asc' % name), grid, self.template, output_formats,
+                                    decimals=decimals, trim=trim, manifest=manifest))
+        return paths
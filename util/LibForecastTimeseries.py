@@ -3,6 +3,8 @@
 from datetime import datetime
 import copy
 
+import numpy as np
+
 COMMON_DATE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
@@ -65,6 +67,55 @@ def extractForecastTimeseriesInDays(timeseries):
     return new_timeseries
 
 
+def getTimeAxis(base_time, model_hours):
+    """
+    Get timestamps of given model hours as a numpy datetime64 array, in one vector operation.
+    E.g. base time 2017-09-01 00:00:00 and model hours [0.5, 1.0] will give
+    ['2017-09-01T00:30:00', '2017-09-01T01:00:00']
+
+    :param datetime base_time: Base time of the model output
+    :param model_hours: Array of model hours
+    :return: datetime64[s] array. Fractions of a second are truncated, the same as strftime
+    """
+    offsets = np.round(np.asarray(model_hours, dtype=np.float64) * 3600e6).astype('timedelta64[us]')
+    return (np.datetime64(base_time, 'us') + offsets).astype('datetime64[s]')
+
+
+def formatTimeAxis(times, date_time_format=COMMON_DATE_TIME_FORMAT):
+    """
+    Format a datetime64 array into timestamp strings in bulk. Only COMMON_DATE_TIME_FORMAT is formatted without a loop.
+
+    :return: list of strings. E.g. ['2017-09-01 00:30:00', '2017-09-01 01:00:00']
+    """
+    times = np.asarray(times).astype('datetime64[s]')
+    if date_time_format == COMMON_DATE_TIME_FORMAT:
+        return np.char.replace(np.datetime_as_string(times, unit='s'), 'T', ' ').tolist()
+    return [t.strftime(date_time_format) for t in times.astype(datetime)]
+
+
+def extractForecastTimeAxis(times, extract_date, extract_time='00:00:00', by_day=False):
+    """
+    Same as extractForecastTimeseries for a datetime64 time axis.
+    :return: index of the first timestamp at or after the given date and time, which is len(times) if there is none
+    """
+    if by_day:
+        extract_date_time = np.datetime64(extract_date, 's')
+    else:
+        extract_date_time = np.datetime64('%sT%s' % (extract_date, extract_time), 's')
+    index = np.flatnonzero(np.asarray(times) >= extract_date_time)
+    return index[0] if len(index) else len(times)
+
+
+def splitTimeAxisInDays(times):
+    """
+    Same as extractForecastTimeseriesInDays for a datetime64 time axis.
+    :return: list of slices, one for each day
+    """
+    days = np.asarray(times).astype('datetime64[D]')
+    bounds = [0] + (np.flatnonzero(days[1:] != days[:-1]) + 1).tolist() + [len(days)]
+    return [slice(bounds[k], bounds[k + 1]) for k in range(len(bounds) - 1) if bounds[k] < bounds[k + 1]]
+
+
 def save_forecast_timeseries(my_adapter, my_timeseries, my_model_date, my_model_time, my_opts):
     print('LibForecastTimeseries:: save_forecast_timeseries')
 
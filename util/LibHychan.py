@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+import mmap
+import re
+
+import numpy as np
+
+from util.LibCache import get_cache_key, load_cache, save_cache
+from util.Utils import loadSidecar, saveSidecar
+
+# Each channel hydrograph block starts with a header line, and the hydrograph rows follow until the next header or EOF
+HYCHAN_HEADER = re.compile(rb'^[ \t]*CHANNEL HYDROGRAPH FOR ELEMENT NO:[ \t]*(\S+)', re.MULTILINE)
+# Columns of hydrograph rows in HYCHAN.OUT. Any further columns are named col<index>
+HYCHAN_COLUMNS = ('time', 'elevation', 'depth', 'velocity', 'discharge', 'froude', 'flow_area', 'wetted_perimeter',
+                  'hydraulic_radius', 'top_width', 'width_depth', 'energy_slope', 'shear_stress', 'surface_area')
+INDEX_SUFFIX = '.idx'
+# Increase whenever parsed values change, to invalidate cached results
+PARSER_VERSION = 1
+
+
+def get_hydrograph_dtype(ncols):
+    """
+    Structured dtype of a hydrograph with given number of columns. E.g. hydrograph['elevation']
+    """
+    return np.dtype([(HYCHAN_COLUMNS[k] if k < len(HYCHAN_COLUMNS) else 'col%d' % k, np.float64)
+                     for k in range(ncols)])
+
+
+def _to_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+
+def parse_hydrograph(buf):
+    """
+    Parse the rows of a single channel hydrograph block. Lines which do not start with a number, such as column
+    titles and blank lines, are skipped. Values which are not numbers are NaN.
+
+    :param bytes buf: Block of HYCHAN.OUT after the header line
+    :return: structured numpy array with a field per column. E.g. hydrograph['time'], hydrograph['elevation']
+    """
+    lines = []
+    for line in buf.splitlines():
+        tokens = line.split(None, 1)
+        if tokens and not np.isnan(_to_float(tokens[0])):
+            lines.append(line)
+    if not lines:
+        return np.empty(0, dtype=get_hydrograph_dtype(len(HYCHAN_COLUMNS)))
+
+    ncols = len(lines[0].split())
+    try:
+        table = np.array(b' '.join(lines).split(), dtype=np.float64).reshape(len(lines), ncols)
+    except ValueError:
+        # Rows with missing or non numeric values
+        table = np.full((len(lines), ncols), np.nan)
+        for k, line in enumerate(lines):
+            values = [_to_float(token) for token in line.split()[:ncols]]
+            table[k, :len(values)] = values
+
+    hydrograph = np.empty(len(lines), dtype=get_hydrograph_dtype(ncols))
+    for k, name in enumerate(hydrograph.dtype.names):
+        hydrograph[name] = table[:, k]
+    return hydrograph
+
+
+def find_hydrographs(path):
+    """
+    Locate the channel hydrograph blocks of a FLO2D HYCHAN.OUT file in a single scan.
+    E.g. the block of element 179 which starts at byte 1024 is returned as ('179', 1024, <byte length of the block>)
+
+    :param string path: HYCHAN.OUT file path
+    :return: list of (element number as string, header byte offset, byte length) in file order
+    """
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return []
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            headers = [(m.group(1).decode(), m.start()) for m in HYCHAN_HEADER.finditer(mm)]
+            return [(element_no, start, (headers[k + 1][1] if k + 1 < len(headers) else len(mm)) - start)
+                    for k, (element_no, start) in enumerate(headers)]
+        finally:
+            mm.close()
+
+
+def get_hydrograph_index(path):
+    """
+    Get the hydrograph blocks of a HYCHAN.OUT file from the sidecar index saved next to it.
+    The index is rebuilt with find_hydrographs when it is missing or the file was changed after it was built.
+
+    :param string path: HYCHAN.OUT file path
+    :return: list of (element number as string, header byte offset, byte length) in file order
+    """
+    hydrographs = loadSidecar(path, INDEX_SUFFIX)
+    if hydrographs is None:
+        hydrographs = find_hydrographs(path)
+        saveSidecar(path, INDEX_SUFFIX, hydrographs)
+    return [tuple(h) for h in hydrographs]
+
+
+def read_hydrograph(f, block):
+    """
+    Read and parse a single hydrograph block.
+
+    :param f: HYCHAN.OUT file opened in binary mode
+    :param block: (element number, header byte offset, byte length) of the block
+    :return: hydrograph structured array
+    """
+    f.seek(block[1])
+    buf = f.read(block[2])
+    header = HYCHAN_HEADER.match(buf)
+    return parse_hydrograph(buf[header.end() if header else 0:])
+
+
+def iter_hydrographs(path, elements=None):
+    """
+    Iterate over the channel hydrographs of a FLO2D HYCHAN.OUT file. Blocks are located with the cached element
+    index, so that only the blocks of the requested elements are read. Each hydrograph ends at the next block header
+    or at EOF.
+    E.g. for element_no, hydrograph in iter_hydrographs('HYCHAN.OUT', elements=['179', '220']):
+
+    :param string path: HYCHAN.OUT file path
+    :param elements: If given, only yield hydrographs of these element numbers (strings)
+    :return: generator of (element number as string, hydrograph structured array) in file order
+    """
+    elements = set(elements) if elements is not None else None
+    blocks = [b for b in get_hydrograph_index(path) if elements is None or b[0] in elements]
+    with open(path, 'rb') as f:
+        for block in blocks:
+            yield block[0], read_hydrograph(f, block)
+
+
+def read_hychan(path, elements=None):
+    """
+    Read the channel hydrographs of a FLO2D HYCHAN.OUT file.
+
+    :param string path: HYCHAN.OUT file path
+    :param elements: If given, only read hydrographs of these element numbers (strings)
+    :return: dict of element number -> hydrograph structured array, in file order
+    """
+    return dict(iter_hydrographs(path, elements))
+
+
+def load_hychan(path, elements=None, cache_dir=None):
+    """
+    Same as read_hychan, but the parsed hydrographs are cached on disk. Repeated loads of the same run return read
+    only memory maps of the cached hydrographs without parsing the file again.
+
+    :param string path: HYCHAN.OUT file path
+    :param elements: If given, only read hydrographs of these element numbers (strings)
+    :param string cache_dir: Cache directory. Default is util.LibCache.CACHE_DIR
+    :return: dict of element number -> hydrograph structured array, in file order
+    """
+    params = {'elements': sorted(set(elements)) if elements is not None else None}
+    key = get_cache_key(path, 'hychan', PARSER_VERSION, params)
+    data = load_cache(key, cache_dir)
+    if data is None:
+        data = read_hychan(path, elements)
+        save_cache(key, data, cache_dir)
+    return data
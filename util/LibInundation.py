@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import csv
+import datetime
+import importlib
+import os
+
+import numpy as np
+
+# Lower bounds of depth classes in m. The last class has no upper bound, e.g. 0.3-0.5, 0.5-1.0 and >=1.0
+DEPTH_CLASSES = (0.3, 0.5, 1.0)
+# File extension of each table output format
+STATS_FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+
+
+def check_stats_format(stats_format):
+    """
+    Check that tables can be saved in the output format, so that a run does not fail only when it saves the table.
+
+    :param string stats_format: One of STATS_FORMATS
+    :raise ValueError: if the format is unknown
+    :raise ImportError: if pyarrow, which is only required for Parquet output, is not installed
+    """
+    if stats_format not in STATS_FORMATS:
+        raise ValueError('Unknown inundation statistics format %s. Available formats are %s' %
+                         (stats_format, ', '.join(STATS_FORMATS)))
+    if stats_format == 'parquet':
+        importlib.import_module('pyarrow.parquet')
+
+
+class InundationStats(object):
+    """
+    Flooded area of each depth class for each timestep of a model run, computed from the grids while they are in
+    memory, so that the rasters need not be read back. Saved as a single table with a row per timestep.
+    E.g. stats = InundationStats(template, base_time)
+         stats.append(hour, grid)
+         stats.save('inundation_stats.csv')
+    """
+
+    def __init__(self, template, base_time, depth_classes=DEPTH_CLASSES, stats_format='csv'):
+        """
+        :param RasterTemplate template: util.LibRaster.RasterTemplate of the grids
+        :param datetime base_time: Base time of model hours
+        :param depth_classes: Increasing lower bounds of depth classes in m
+        :param string stats_format: Table output format of STATS_FORMATS
+        :raise ValueError: if the format is unknown
+        :raise ImportError: if pyarrow is not installed for Parquet output
+        """
+        check_stats_format(stats_format)
+        self.stats_format = stats_format
+        self.base_time = base_time
+        self.cell_area = template.cellsize ** 2
+        self.bins = np.append(np.asarray(depth_classes, dtype=np.float64), np.inf)
+        self.columns = ['time', 'hour', 'wet_area', 'max_depth'] + \
+                       ['area_%g-%g' % (low, high) for low, high in zip(self.bins[:-2], self.bins[1:-1])] + \
+                       ['area_>=%g' % self.bins[-2]]
+        self.rows = []
+
+    def append(self, hour, grid):
+        """
+        Append the statistics of the grid of a timestep. Areas are in square units of the cell size.
+
+        :param float hour: Model hour of the timestep
+        :param grid: nrows x ncols array with NaN as NODATA
+        """
+        depths = np.asarray(grid).ravel()
+        depths = depths[~np.isnan(depths)]
+        # Bounds are compared in the dtype of the grid, so that a float32 depth of 0.7 is in the class from 0.7
+        bins = self.bins.astype(depths.dtype) if np.issubdtype(depths.dtype, np.floating) else self.bins
+        counts, _ = np.histogram(depths, bins=bins)
+        time = self.base_time + datetime.timedelta(hours=float(hour))
+        self.rows.append([time.strftime('%Y-%m-%d %H:%M:%S'), float(hour), len(depths) * self.cell_area,
+                          # Rounded, since float32 depths such as 1.234 are not exact in float64
+                          round(float(depths.max()), 6) if len(depths) else float('nan')] +
+                         (counts * self.cell_area).tolist())
+
+    def save(self, path):
+        """
+        Save the table in the output format. The extension of the path is replaced by the extension of the format.
+
+        :param string path: Output file path
+        :return: path of the written file
+        """
+        path = os.path.splitext(path)[0] + STATS_FORMATS[self.stats_format]
+        if self.stats_format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.table({column: [row[k] for row in self.rows] for k, column in enumerate(self.columns)})
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(self.columns)
+                writer.writerows(self.rows)
+        return path
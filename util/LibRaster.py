@@ -0,0 +1,816 @@
+#!/usr/bin/python3
+
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from util.LibCache import get_cached
+from util.LibCadpts import get_cell_index
+
+# Approximate number of bytes which are encoded and written at once
+CHUNK_SIZE = 1 << 22
+
+_FRACTION_TABLES = {}
+# File extension of each raster output format
+OUTPUT_FORMATS = {
+    'asc': '.asc',
+    'asc.gz': '.asc.gz',
+    'asc.zst': '.asc.zst',
+    'flt': '.flt',
+    'tif': '.tif'
+}
+# File extensions of the files which are written next to the raster file of an output format
+SIDECAR_EXTENSIONS = {
+    'flt': ('.hdr',)
+}
+# File extension of each output format which stores the grids of all timesteps in a single file
+STACK_FORMATS = {
+    'nc': '.nc',
+    'sparse': '.npz'
+}
+TIFF_TILE_SIZE = 256
+GZIP_LEVEL = 6
+# Content hashes of the rasters of an output directory
+RASTER_MANIFEST_FILE = 'manifest.json'
+ZSTD_LEVEL = 3
+# Increase whenever the template index changes, to invalidate cached templates
+TEMPLATE_VERSION = 1
+
+
+def round_half_even(values, decimals=2):
+    """
+    Round values to given decimals, the same as round(decimal.Decimal(str(value)), decimals) does for each value.
+    Ties of the shortest decimal representation are rounded half to even, e.g. 0.165 -> 0.16 and 0.175 -> 0.18
+
+    :param values: numpy array of values
+    :param int decimals: Number of decimal places
+    :return: float64 array of rounded values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10.0 ** decimals
+    with np.errstate(invalid='ignore'):
+        rounded = np.round(values * scale)
+        # A value like 0.165 is slightly above or below the tie in binary, but is a tie as a decimal
+        tens = np.rint(values * scale * 10)
+        is_tie = (np.abs(np.fmod(tens, 10)) == 5) & (tens / (scale * 10) == values)
+    if is_tie.any():
+        lower = np.trunc(tens[is_tie] / 10)
+        rounded[is_tie] = lower + np.sign(tens[is_tie]) * (np.fmod(lower, 2) != 0)
+    return rounded / scale
+
+
+def get_decimals(values, min_decimals=0, max_decimals=6):
+    """
+    Get the least number of decimal places which represents all values exactly, e.g. 3 for values parsed from
+    '0.125' and '1.5', so that values can be written without rounding away digits of the input.
+
+    :param values: numpy array of values parsed from text. NaN values are ignored
+    :param int min_decimals: Lower bound
+    :param int max_decimals: Upper bound, which is returned if values have more decimal places. The default keeps the
+    digits which float32 grids hold for depths and levels
+    :return: int
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    for decimals in range(min_decimals, max_decimals):
+        scaled = values * 10.0 ** decimals
+        if (np.abs(scaled - np.rint(scaled)) <= 1e-9 * np.maximum(1.0, np.abs(scaled))).all():
+            return decimals
+    return max_decimals
+
+
+def open_raster(path, mode='rb'):
+    """
+    Open a raster file, which is gzip or zstd compressed when the path ends with .gz or .zst, the same as open().
+    E.g. with open_raster('water_level_grid.asc.gz', 'rt') as f:
+
+    :param string path: File path
+    :param string mode: One of 'rb', 'wb', 'rt' and 'wt'
+    :return: file object
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    if path.endswith('.zst'):
+        # zstandard is only required for .zst files
+        import zstandard
+        if 'r' in mode:
+            f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+        else:
+            f = io.BufferedWriter(zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb'),
+                                                                                          closefd=True))
+        return io.TextIOWrapper(f, encoding='ascii') if 't' in mode else f
+    return open(path, mode)
+
+
+class RasterHeader(dict):
+    """
+    Values of the header of a raster file by key as written, e.g. header['ncols'] or header['NCOLS'].
+    The header lines are kept as they are in lines.
+    """
+
+    def __init__(self, values, lines):
+        dict.__init__(self, values)
+        self.lines = lines
+
+    def get_value(self, key, default=None):
+        """
+        Get a header value, ignoring the case of the key. E.g. header.get_value('nodata_value')
+        """
+        for k, v in self.items():
+            if k.lower() == key.lower():
+                return v
+        return default
+
+    def replace_lines(self, values, exclude=()):
+        """
+        Get the header lines with given values, written with the delimiter and line ending of the header. Keys which
+        are not in the header are appended, and keys in exclude are dropped.
+        E.g. header.replace_lines({'NODATA_value': -9999}, exclude=['byteorder'])
+
+        :param dict values: Header values by key, ignoring the case of the key
+        :param exclude: Keys of lines to drop, ignoring the case of the key
+        :return: list of header lines
+        """
+        delimiter, newline = '\t', '\n'
+        if self.lines:
+            first = self.lines[0]
+            rest = first[len(first.split()[0]):]
+            delimiter = rest[:len(rest) - len(rest.lstrip(' \t'))] or delimiter
+            newline = first[len(first.rstrip('\r\n')):] or newline
+        values = {k.lower(): (k, v) for k, v in values.items()}
+        exclude = [k.lower() for k in exclude]
+        lines = []
+        for line in self.lines:
+            key = line.split()[0]
+            if key.lower() in exclude:
+                continue
+            if key.lower() in values:
+                line = '%s%s%s%s' % (key, delimiter, values.pop(key.lower())[1], newline)
+            lines.append(line)
+        lines.extend('%s%s%s%s' % (k, delimiter, v, newline) for k, v in values.values())
+        return lines
+
+
+def read_esri_header(f):
+    """
+    Read the header lines of an ESRI grid from a binary file object, which may be tab or space delimited.
+    The file is left after the header, apart from the first line of the body, which is returned.
+
+    :return: (RasterHeader, first body line as bytes, which is empty if there is no body)
+    """
+    values, lines = {}, []
+    while True:
+        line = f.readline()
+        tokens = line.split()
+        if len(tokens) != 2 or not tokens[0][:1].isalpha() or tokens[0].lower() in (b'nan', b'inf'):
+            return RasterHeader(values, lines), line
+        try:
+            values[tokens[0].decode()] = float(tokens[1])
+        except ValueError:
+            # E.g. byteorder LSBFIRST
+            values[tokens[0].decode()] = tokens[1].decode()
+        lines.append(line.decode())
+
+
+def get_geotransform(header):
+    """
+    Get the GDAL style geotransform of an ESRI grid header, i.e. (x of the upper left corner, cell width, 0,
+    y of the upper left corner, 0, -cell height)
+    """
+    cellsize = header.get_value('cellsize')
+    xll = header.get_value('xllcorner')
+    yll = header.get_value('yllcorner')
+    if xll is None:
+        xll = header.get_value('xllcenter') - cellsize / 2
+    if yll is None:
+        yll = header.get_value('yllcenter') - cellsize / 2
+    return xll, cellsize, 0.0, yll + header.get_value('nrows') * cellsize, 0.0, -cellsize
+
+
+def read_flt(path, mmap=True):
+    """
+    Read an ESRI binary grid, i.e. the float32 values in .flt in the byte order of the header in .hdr next to it.
+    NODATA cells keep the NODATA value.
+
+    :param string path: .flt file path
+    :param boolean mmap: Whether to memory map the values. Otherwise those are read into memory
+    :return: (nrows x ncols array, RasterHeader)
+    """
+    with open(os.path.splitext(path)[0] + '.hdr', 'rb') as f:
+        header, line = read_esri_header(f)
+    shape = (int(header.get_value('nrows')), int(header.get_value('ncols')))
+    byte_order = '>' if str(header.get_value('byteorder', '')).upper() == 'MSBFIRST' else '<'
+    if mmap:
+        return np.memmap(path, dtype=byte_order + 'f4', mode='r', shape=shape), header
+    return np.fromfile(path, dtype=byte_order + 'f4').reshape(shape), header
+
+
+def read_raster(path, mmap=True):
+    """
+    Read an ESRI ASCII grid, which may be gzip or zstd compressed (.gz or .zst), or an ESRI binary grid (.flt with
+    .hdr). The header is parsed once. The body of ASCII grids is parsed in bulk, and binary grids are memory mapped.
+    NODATA cells keep the NODATA value.
+    E.g. data, geotransform, header = read_raster('water_level_grid.asc')
+
+    :param string path: File path
+    :param boolean mmap: Whether to memory map binary grids. Otherwise those are read into memory
+    :return: (nrows x ncols array, GDAL style geotransform, RasterHeader)
+    """
+    if path.endswith('.flt'):
+        data, header = read_flt(path, mmap)
+        return data, get_geotransform(header), header
+
+    with open_raster(path, 'rb') as f:
+        header, line = read_esri_header(f)
+        body = line + f.read()
+    shape = (int(header.get_value('nrows')), int(header.get_value('ncols')))
+    # The C parser of loadtxt over the body in memory is the fastest bulk parser of numpy
+    data = np.loadtxt(io.BytesIO(body), dtype=np.float64, ndmin=2)
+    if data.size != shape[0] * shape[1]:
+        raise ValueError('%s has %d values, while the header has %d rows and %d columns' %
+                         (path, data.size, shape[0], shape[1]))
+    return data.reshape(shape), get_geotransform(header), header
+
+
+def get_esri_header(ncols, nrows, xllcorner, yllcorner, cellsize, nodata):
+    """
+    Header lines of an ESRI ASCII grid. Esri GRID format : https://en.wikipedia.org/wiki/Esri_grid
+    """
+    return [
+        '%s\t%s\n' % ('ncols', ncols),
+        '%s\t%s\n' % ('nrows', nrows),
+        '%s\t%s\n' % ('xllcorner', xllcorner),
+        '%s\t%s\n' % ('yllcorner', yllcorner),
+        '%s\t%s\n' % ('cellsize', cellsize),
+        '%s\t%s\n' % ('NODATA_value', nodata)
+    ]
+
+
+def _get_fraction_table(decimals):
+    """
+    Digits of the fractional part for each scaled remainder. E.g. for 2 decimals 5 -> b'.05'
+    """
+    if decimals not in _FRACTION_TABLES:
+        _FRACTION_TABLES[decimals] = np.array([('.%0*d' % (decimals, k)).encode() for k in range(10 ** decimals)])
+    return _FRACTION_TABLES[decimals]
+
+
+def _format_scaled(keys, decimals):
+    """
+    Format unique scaled integer keys (value * 10^decimals * 2 + sign bit) as fixed precision numbers.
+    """
+    negative = (keys & 1).astype(bool)
+    integer, fraction = np.divmod(np.abs(keys >> 1), 10 ** decimals)
+    text = np.char.encode(np.char.mod('%d', integer), 'ascii')
+    if decimals > 0:
+        text = np.char.add(text, _get_fraction_table(decimals)[fraction])
+    return np.where(negative, np.char.add(b'-', text), text)
+
+
+def get_esri_tokens(values, nodata=None, decimals=2, trim=False):
+    """
+    Format values as '%.<decimals>f' does, only once for each distinct value.
+    Values are scaled to integers, and the digits are taken from precomputed tables. Values which are close to a
+    rounding tie in binary, too large or not finite are formatted with printf instead, so the output is byte-identical.
+
+    :param values: numpy array of values
+    :param nodata: If given, NaN values are written as str(nodata). Otherwise they are written as 'nan'
+    :param int decimals: Number of decimal places
+    :param boolean trim: Remove trailing zeros, keeping at least one decimal place. E.g. 0.500 -> 0.5
+    :return: (bytes array of distinct tokens, index of the token of each value with the shape of values)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    flat = values.ravel()
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = flat * 10.0 ** decimals
+        rounded = np.rint(scaled)
+        exact = (np.abs(scaled) < 2.0 ** 52) & \
+            (np.abs(np.abs(scaled - rounded) - 0.5) > np.abs(scaled) * 1e-15 + 1e-12)
+    missing = np.isnan(flat) if nodata is not None else np.zeros(len(flat), dtype=bool)
+    others = ~exact & ~missing
+    index = np.empty(len(flat), dtype=np.int64)
+
+    keys, inverse = np.unique(rounded[exact].astype(np.int64) * 2 + np.signbit(flat[exact]), return_inverse=True)
+    index[exact] = inverse
+    tokens = _format_scaled(keys, decimals).astype(bytes)
+    if others.any():
+        text, inverse = np.unique([('%.*f' % (decimals, v)).encode() for v in flat[others]], return_inverse=True)
+        index[others] = len(tokens) + inverse
+        tokens = np.concatenate([tokens, text])
+    if trim and decimals > 1:
+        tokens = np.char.rstrip(tokens, b'0')
+        tokens = np.where(np.char.endswith(tokens, b'.'), np.char.add(tokens, b'0'), tokens)
+    if missing.any():
+        index[missing] = len(tokens)
+        tokens = np.append(tokens, str(nodata).encode())
+    return tokens, index.reshape(values.shape)
+
+
+def encode_esri_rows(grid, nodata=None, decimals=2, trim=False, delimiter=b' '):
+    """
+    Encode the rows of a grid as ESRI ASCII grid lines in bulk, the same as np.savetxt(fmt='%.<decimals>f') does.
+    Each value is copied from its token, and the delimiters are placed in a single vectorized pass.
+
+    :param grid: 2D array. A 1D array is written as a single column
+    :param nodata: If given, NaN cells are written as str(nodata). E.g. -9999
+    :param int decimals: Number of decimal places of values
+    :param boolean trim: Remove trailing zeros, keeping at least one decimal place. E.g. 0.500 -> 0.5
+    :param bytes delimiter: Single byte delimiter between values of a row
+    :return: bytes of the lines
+    """
+    grid = np.asarray(grid)
+    if grid.ndim == 1:
+        grid = grid.reshape(-1, 1)
+    if grid.size == 0:
+        return b'\n' * grid.shape[0]
+    tokens, index = get_esri_tokens(grid, nodata, decimals, trim)
+    width = tokens.dtype.itemsize
+    table = np.zeros((len(tokens), width + 1), dtype=np.uint8)
+    table[:, :width] = tokens.view(np.uint8).reshape(len(tokens), width)
+    lengths = np.char.str_len(tokens)
+
+    index = index.ravel()
+    cells = table[index]
+    cell_lengths = lengths[index]
+    cells[np.arange(len(index)), cell_lengths] = ord(delimiter)
+    cells.reshape(grid.shape[0], grid.shape[1], width + 1)[:, -1, :][
+        np.arange(grid.shape[0]), cell_lengths.reshape(grid.shape)[:, -1]] = ord(b'\n')
+    return cells[np.arange(width + 1) <= cell_lengths[:, np.newaxis]].tobytes()
+
+
+def write_esri_rows(f, grid, nodata=None, decimals=2, trim=False, delimiter=b' ', chunk_size=CHUNK_SIZE):
+    """
+    Write the rows of a grid to a binary file in chunks of about chunk_size bytes.
+    E.g. write_esri_rows(f, data, decimals=4) writes the same bytes as np.savetxt(f, data, fmt='%.4f')
+    """
+    grid = np.asarray(grid)
+    if grid.ndim == 1:
+        grid = grid.reshape(-1, 1)
+    step = max(1, chunk_size // (max(1, grid.shape[1]) * (decimals + 8)))
+    for start in range(0, grid.shape[0], step):
+        f.write(encode_esri_rows(grid[start:start + step], nodata, decimals, trim, delimiter))
+
+
+def format_esri_rows(grid, nodata, decimals=2, trim=False, chunk_size=CHUNK_SIZE):
+    """
+    Format the rows of a grid as ESRI ASCII grid lines. NaN cells are written as the NODATA value.
+
+    :param grid: 2D array
+    :param nodata: NODATA value, which is written with str(). E.g. -9999
+    :param int decimals: Number of decimal places of values
+    :param boolean trim: Remove trailing zeros, keeping at least one decimal place. E.g. 0.500 -> 0.5
+    :param int chunk_size: Approximate size of each returned string
+    :return: list of strings, each of which holds the lines of a block of rows
+    """
+    grid = np.asarray(grid)
+    step = max(1, chunk_size // (max(1, grid.shape[1]) * (decimals + 8)))
+    return [encode_esri_rows(grid[start:start + step], nodata, decimals, trim).decode('ascii')
+            for start in range(0, grid.shape[0], step)]
+
+
+def get_template_index(path, gap=250.0):
+    """
+    Compute the grid boundary and the flat grid index (row * ncols + col) of each cell of CADPTS.DAT.
+
+    :param string path: CADPTS.DAT file path
+    :param float gap: Grid cell size
+    :return: dict of 'boundary' [long_min, lat_min, long_max, lat_max] and dense 'index' array indexed by cell id,
+    which is -1 for cell ids not in the file
+    """
+    cell_index = get_cell_index(path, gap)
+    boundary = cell_index['boundary']
+    ncols = int(math.ceil((boundary[2] - boundary[0]) / gap)) + 1
+    rows, cols = cell_index['rows'], cell_index['cols']
+    index = np.where((rows >= 0) & (cols >= 0), rows * ncols + cols, -1)
+    return {
+        'boundary': boundary,
+        'index': index
+    }
+
+
+class RasterTemplate(object):
+    """
+    Raster layout of a FLO2D model which is shared by every timestep: dimensions, origin, cell size, header and the
+    flat grid index of each cell.
+    E.g. grid = template.build_grid(cells, depths, threshold=0.3, decimals=2)
+         f.writelines(template.format_grid(grid))
+    """
+
+    def __init__(self, boundary, index, gap, nodata=-9999, origin_offset=None):
+        self.boundary = {
+            'long_min': float(boundary[0]),
+            'lat_min': float(boundary[1]),
+            'long_max': float(boundary[2]),
+            'lat_max': float(boundary[3])
+        }
+        self.index = index
+        self.cellsize = gap
+        self.nodata = nodata
+        self.ncols = int(math.ceil((self.boundary['long_max'] - self.boundary['long_min']) / gap)) + 1
+        self.nrows = int(math.ceil((self.boundary['lat_max'] - self.boundary['lat_min']) / gap)) + 1
+        # Cell centers are offset by half a cell from the lower left corner by default
+        origin_offset = gap / 2 if origin_offset is None else origin_offset
+        self.xllcorner = self.boundary['long_min'] - origin_offset
+        self.yllcorner = self.boundary['lat_min'] - origin_offset
+        self.header = ''.join(get_esri_header(self.ncols, self.nrows, self.xllcorner, self.yllcorner, gap, nodata))
+        self.header_bytes = self.header.encode('ascii')
+
+    def __str__(self):
+        return 'ncols: %d, nrows: %d, xllcorner: %s, yllcorner: %s, cellsize: %s' % \
+               (self.ncols, self.nrows, self.xllcorner, self.yllcorner, self.cellsize)
+
+    def build_grid(self, cells, values, threshold=None, decimals=None):
+        """
+        Build a raster of cell values. Cells without a value, or with a value below the threshold, are NODATA (NaN).
+        Cells which are not in the grid are skipped, and printed as a warning.
+
+        :param cells: Cell ids
+        :param values: Values of the cells
+        :param float threshold: If given, only keep values greater than or equal to this value
+        :param int decimals: If given, round values with round_half_even before the threshold is applied
+        :return: float32 array of nrows x ncols
+        """
+        cells = np.asarray(cells, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if decimals is not None:
+            values = round_half_even(values, decimals)
+        if threshold is not None:
+            is_kept = values >= threshold
+            cells, values = cells[is_kept], values[is_kept]
+        index = np.full(len(cells), -1, dtype=np.int64)
+        known = (cells >= 0) & (cells < len(self.index))
+        index[known] = self.index[cells[known]]
+        inside = index >= 0
+        if not inside.all():
+            print('### WARNING %d cells are outside of the grid: %s' % ((~inside).sum(), cells[~inside][:10]))
+        grid = np.full(self.nrows * self.ncols, np.nan, dtype=np.float32)
+        grid[index[inside]] = values[inside]
+        return grid.reshape(self.nrows, self.ncols)
+
+    def format_grid(self, grid, decimals=2, trim=False):
+        """
+        Format a grid as ESRI ASCII grid. NaN cells are written as the NODATA value.
+
+        :return: list of strings, which starts with the header
+        """
+        lines = [self.header]
+        lines.extend(format_esri_rows(grid, self.nodata, decimals, trim))
+        return lines
+
+
+def get_nodata_grid(grid, nodata):
+    """
+    Copy of a grid as little endian float32, in which NaN cells are set to the NODATA value.
+    """
+    grid = np.array(grid, dtype='<f4')
+    grid[np.isnan(grid)] = nodata
+    return grid
+
+
+def write_flt(path, grid, template):
+    """
+    Write a grid as ESRI binary grid, i.e. the raw float32 values in .flt and the header in .hdr next to it.
+
+    :param string path: .flt file path
+    :param grid: nrows x ncols array with NaN as NODATA
+    :param RasterTemplate template: Raster template of the grid
+    """
+    get_nodata_grid(grid, template.nodata).tofile(path)
+    with open(os.path.splitext(path)[0] + '.hdr', 'w') as f:
+        f.write(template.header)
+        f.write('%s\t%s\n' % ('byteorder', 'LSBFIRST'))
+
+
+def _get_tiff_entry(tag, field_type, values):
+    """
+    IFD entry of a classic little endian TIFF, as (tag, type, count, values as bytes).
+    """
+    fmt = {2: 's', 3: 'H', 4: 'I', 12: 'd'}[field_type]
+    if field_type == 2:
+        data = values.encode('ascii') + b'\0'
+        return tag, field_type, len(data), data
+    return tag, field_type, len(values), struct.pack('<%d%s' % (len(values), fmt), *values)
+
+
+def write_geotiff(path, grid, template, tile_size=TIFF_TILE_SIZE, compress_level=6):
+    """
+    Write a grid as a float32 GeoTIFF which is internally tiled and deflate compressed, with the same georeferencing
+    as the ESRI ASCII grid. The NODATA value is written in the GDAL_NODATA tag.
+
+    :param string path: .tif file path
+    :param grid: nrows x ncols array with NaN as NODATA
+    :param RasterTemplate template: Raster template of the grid
+    :param int tile_size: Width and height of tiles, which must be a multiple of 16
+    :param int compress_level: zlib compression level
+    """
+    grid = get_nodata_grid(grid, template.nodata)
+    nrows, ncols = grid.shape
+    tiles_down, tiles_across = -(-nrows // tile_size), -(-ncols // tile_size)
+    padded = np.full((tiles_down * tile_size, tiles_across * tile_size), template.nodata, dtype='<f4')
+    padded[:nrows, :ncols] = grid
+
+    with open(path, 'wb') as f:
+        f.write(b'II*\0\0\0\0\0')
+        offsets, counts = [], []
+        for j in range(tiles_down):
+            for i in range(tiles_across):
+                tile = padded[j * tile_size:(j + 1) * tile_size, i * tile_size:(i + 1) * tile_size]
+                data = zlib.compress(np.ascontiguousarray(tile).tobytes(), compress_level)
+                offsets.append(f.tell())
+                counts.append(len(data))
+                f.write(data)
+
+        entries = [
+            _get_tiff_entry(256, 4, [ncols]),  # ImageWidth
+            _get_tiff_entry(257, 4, [nrows]),  # ImageLength
+            _get_tiff_entry(258, 3, [32]),  # BitsPerSample
+            _get_tiff_entry(259, 3, [8]),  # Compression: Deflate
+            _get_tiff_entry(262, 3, [1]),  # PhotometricInterpretation: BlackIsZero
+            _get_tiff_entry(277, 3, [1]),  # SamplesPerPixel
+            _get_tiff_entry(284, 3, [1]),  # PlanarConfiguration: Chunky
+            _get_tiff_entry(322, 4, [tile_size]),  # TileWidth
+            _get_tiff_entry(323, 4, [tile_size]),  # TileLength
+            _get_tiff_entry(324, 4, offsets),  # TileOffsets
+            _get_tiff_entry(325, 4, counts),  # TileByteCounts
+            _get_tiff_entry(339, 3, [3]),  # SampleFormat: IEEE floating point
+            _get_tiff_entry(33550, 12, [template.cellsize, template.cellsize, 0.0]),  # ModelPixelScale
+            # ModelTiepoint: upper left corner of the upper left pixel
+            _get_tiff_entry(33922, 12, [0.0, 0.0, 0.0, template.xllcorner,
+                                        template.yllcorner + nrows * template.cellsize, 0.0]),
+            # GeoKeyDirectory: GTModelType projected, GTRasterType PixelIsArea
+            _get_tiff_entry(34735, 3, [1, 1, 0, 2, 1024, 0, 1, 1, 1025, 0, 1, 1]),
+            _get_tiff_entry(42113, 2, str(template.nodata))  # GDAL_NODATA
+        ]
+        # Values which do not fit into 4 bytes are written before the IFD
+        values = {}
+        for tag, field_type, count, data in entries:
+            if len(data) > 4:
+                if f.tell() % 2:
+                    f.write(b'\0')
+                values[tag] = f.tell()
+                f.write(data)
+        if f.tell() % 2:
+            f.write(b'\0')
+        ifd_offset = f.tell()
+        f.write(struct.pack('<H', len(entries)))
+        for tag, field_type, count, data in entries:
+            value = struct.pack('<I', values[tag]) if tag in values else data.ljust(4, b'\0')
+            f.write(struct.pack('<HHI', tag, field_type, count) + value)
+        f.write(struct.pack('<I', 0))
+        f.seek(4)
+        f.write(struct.pack('<I', ifd_offset))
+
+
+def get_output_path(path, output_format):
+    """
+    Replace the extension of the path by the extension of the output format of OUTPUT_FORMATS.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Unknown raster output format %s. Available formats are %s' %
+                         (output_format, ', '.join(list(OUTPUT_FORMATS) + list(STACK_FORMATS))))
+    return os.path.splitext(path)[0] + OUTPUT_FORMATS[output_format]
+
+
+def get_sidecar_paths(path, output_format):
+    """
+    Paths of the files of SIDECAR_EXTENSIONS which are written next to the raster file of the output format.
+    E.g. get_sidecar_paths('water_level_grid.asc', 'flt') is ['water_level_grid.hdr']
+    """
+    return [os.path.splitext(path)[0] + extension for extension in SIDECAR_EXTENSIONS.get(output_format, ())]
+
+
+class RasterManifest(object):
+    """
+    Content hashes of the rasters of an output directory, which are saved in manifest.json of the directory as
+    {"files": {<file name>: <sha1>}}. On re-runs, rasters with the same content hash are not written again, and sync
+    jobs can transfer only the files of which the hash changed. Sidecar files such as .hdr of .flt are recorded with
+    the hash of their raster, since they are written together.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, RASTER_MANIFEST_FILE)
+        self.lock = threading.Lock()
+        self.changed = False
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            self.files = {}
+
+    @staticmethod
+    def get_hash(grid, template, output_format, decimals, trim):
+        """
+        Hash of the content of a raster file, computed from the grid before it is encoded.
+        """
+        digest = hashlib.sha1(json.dumps([output_format, decimals, trim, template.header]).encode())
+        digest.update(np.ascontiguousarray(grid, dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
+    def is_unchanged(self, path, digest):
+        """
+        :return: True if the file exists and has the given content hash
+        """
+        with self.lock:
+            return self.files.get(os.path.basename(path)) == digest and os.path.exists(path)
+
+    def discard(self, path):
+        """
+        Remove the entry of a file which is about to be rewritten. The manifest is saved right away if the file had an
+        entry, so that a run which is interrupted after rewriting the file never leaves the hash of the old content.
+        """
+        with self.lock:
+            if self.files.pop(os.path.basename(path), None) is None:
+                return
+            self.changed = True
+        self.save()
+
+    def update(self, path, digest):
+        with self.lock:
+            self.files[os.path.basename(path)] = digest
+            self.changed = True
+
+    def save(self):
+        """
+        Save the manifest if it was changed. The file is replaced atomically.
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'files': self.files}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self.changed = False
+
+
+def save_grid(path, grid, template, output_format='asc', decimals=2, trim=False):
+    """
+    Save a grid in given output format. The extension of the path is replaced by the extension of the format.
+    E.g. save_grid('water_level_grid.asc', grid, template, 'tif') writes water_level_grid.tif
+
+    :param string path: Output file path
+    :param grid: nrows x ncols array with NaN as NODATA
+    :param RasterTemplate template: Raster template of the grid
+    :param string output_format: One of OUTPUT_FORMATS. 'asc' ESRI ASCII grid, which is compressed as it is written
+    for 'asc.gz' and 'asc.zst', 'flt' ESRI binary grid with .hdr and 'tif' tiled GeoTIFF
+    :param int decimals: Number of decimal places of ESRI ASCII grid values
+    :param boolean trim: Remove trailing zeros of ESRI ASCII grid values, keeping at least one decimal place
+    :return: path of the written file
+    """
+    path = get_output_path(path, output_format)
+    if output_format.startswith('asc'):
+        with open_raster(path, 'wb') as f:
+            f.write(template.header_bytes)
+            write_esri_rows(f, grid, template.nodata, decimals, trim)
+    elif output_format == 'flt':
+        write_flt(path, grid, template)
+    else:
+        write_geotiff(path, grid, template)
+    return path
+
+
+def save_grids(path, grid, template, output_formats, decimals=2, trim=False, manifest=None):
+    """
+    Save a grid in each of the given output formats of OUTPUT_FORMATS, and print the written file names.
+    Formats of STACK_FORMATS are skipped, since those are written with open_raster_stacks.
+
+    :param RasterManifest manifest: If given, files which already have the same content are not written again
+    :return: list of paths of the written files
+    """
+    paths = []
+    for output_format in output_formats:
+        if output_format in STACK_FORMATS:
+            continue
+        if manifest is not None:
+            digest = manifest.get_hash(grid, template, output_format, decimals, trim)
+            output_path = get_output_path(path, output_format)
+            files = [output_path] + get_sidecar_paths(path, output_format)
+            if all(manifest.is_unchanged(f, digest) for f in files):
+                print('Unchanged :', os.path.basename(output_path))
+                continue
+            for f in files:
+                manifest.discard(f)
+        paths.append(save_grid(path, grid, template, output_format, decimals, trim))
+        if manifest is not None:
+            for f in files:
+                manifest.update(f, digest)
+        print('Write to :', os.path.basename(paths[-1]))
+    return paths
+
+
+class RasterWriterPool(object):
+    """
+    Encode and write rasters on background threads, while the next timesteps are parsed and built. At most
+    max_pending rasters wait to be written, and submit blocks until a writer is free when the writers fall behind,
+    so that memory stays bounded. With no threads, rasters are written synchronously by submit.
+    E.g. pool = RasterWriterPool(threads=2)
+         pool.submit(save_grids, path, grid, template, ['asc', 'tif'])
+         pool.close()
+    """
+
+    def __init__(self, threads=2, max_pending=None):
+        """
+        :param int threads: Number of writer threads. 0 writes synchronously
+        :param int max_pending: Maximum number of rasters which are queued or being written. Default is 2 * threads
+        """
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * max(1, threads))
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on a writer thread. Errors of finished writes are raised here.
+        The arguments must not be changed afterwards.
+        """
+        if self.executor is None:
+            fn(*args, **kwargs)
+            return
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        self.futures.append(future)
+        self._check_done()
+
+    def _check_done(self):
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def close(self):
+        """
+        Wait until all rasters are written. The first error of the writes is raised.
+        """
+        if self.executor is None:
+            return
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.futures = []
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_raster_stacks(path, template, base_time, output_formats):
+    """
+    Open a writer for each of the given formats which store the grids of all timesteps in a single file. Other formats
+    are ignored. Each writer has append(hour, grid) and close(). The extension of the path is replaced by the extension
+    of the format. E.g. stacks = open_raster_stacks('water_level_grid.asc', template, base_time, ['asc', 'nc'])
+
+    :param string path: Output file path
+    :param RasterTemplate template: Raster template of the grids
+    :param datetime base_time: Base time of model hours
+    :param output_formats: Output formats. 'nc' NetCDF4 cube of (time, y, x) and 'sparse' wet cells of timesteps
+    :return: list of writers
+    """
+    stacks = []
+    for output_format in output_formats:
+        if output_format not in STACK_FORMATS:
+            continue
+        stack_path = os.path.splitext(path)[0] + STACK_FORMATS[output_format]
+        if output_format == 'nc':
+            # netCDF4 is only required for the NetCDF output
+            from util.LibRasterStack import RasterStackWriter
+            stacks.append(RasterStackWriter(stack_path, template, base_time))
+        else:
+            from util.LibSparseRaster import SparseRasterWriter
+            stacks.append(SparseRasterWriter(stack_path, template, base_time))
+    return stacks
+
+
+def load_raster_template(path, gap=250.0, nodata=-9999, origin_offset=None, cache_dir=None):
+    """
+    Load the raster template of a FLO2D model from its CADPTS.DAT. The template index is cached on disk as .npy for
+    each grid size, i.e. for each of FLO2D_250, FLO2D_150, FLO2D_30 and FLO2D_10, so that it is derived only once.
+
+    :param string path: CADPTS.DAT file path
+    :param float gap: Grid cell size of the model
+    :param nodata: NODATA value of the header
+    :param float origin_offset: Offset of the lower left corner from the minimum cell center. Default is gap / 2
+    :param string cache_dir: Cache directory. Default is util.LibCache.CACHE_DIR
+    :return: RasterTemplate
+    """
+    index = get_cached(path, 'raster_template', TEMPLATE_VERSION, get_template_index, cache_dir=cache_dir, gap=gap)
+    return RasterTemplate(index['boundary'], index['index'], gap, nodata, origin_offset)
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from util.LibRaster import encode_esri_rows, get_geotransform, open_raster, read_esri_header, read_flt
+
+# Number of grid rows which are read, evaluated and written at once
+BLOCK_ROWS = 256
+DEFAULT_NODATA = -9999
+
+
+def _mean(grids):
+    stack = np.array(grids)
+    count = np.sum(~np.isnan(stack), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, np.nansum(stack, axis=0) / count, np.nan)
+
+
+# Operations over a list of aligned row blocks, in which NODATA cells are NaN. A NaN result is written as NODATA
+OPERATIONS = {
+    'difference': lambda grids: grids[0] - grids[1],
+    'sum': lambda grids: np.sum(grids, axis=0),
+    # Maximum, minimum and mean of the cells which are not NODATA
+    'max': lambda grids: np.fmax.reduce(grids),
+    'min': lambda grids: np.fmin.reduce(grids),
+    'mean': _mean
+}
+
+
+def threshold_mask(value, index=0):
+    """
+    Operation which gives 1 for cells of the raster at index with a value greater than or equal to the threshold, and
+    NODATA otherwise. E.g. evaluate_rasters(['depth.asc'], threshold_mask(0.3), 'flooded.asc')
+    """
+    def mask(grids):
+        with np.errstate(invalid='ignore'):
+            return np.where(grids[index] >= value, 1.0, np.nan)
+    return mask
+
+
+class _RowBlockReader(object):
+    """
+    Read the rows of a raster in blocks, so that only a block is held in memory. Binary grids are memory mapped, and
+    the rows of ASCII grids are read as bytes, which are parsed by parse_block.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.flt'):
+            self.data, self.header = read_flt(path)
+            self.f = None
+        else:
+            self.f = open_raster(path, 'rb')
+            self.header, self.line = read_esri_header(self.f)
+            self.data = None
+        self.nodata = self.header.get_value('NODATA_value')
+
+    def get_shape(self):
+        return int(self.header.get_value('nrows')), int(self.header.get_value('ncols'))
+
+    def read_block(self, start, end):
+        """
+        :return: rows [start, end) as an array for binary grids, or as bytes for ASCII grids
+        """
+        if self.data is not None:
+            return np.array(self.data[start:end])
+        lines = [self.line] if self.line else []
+        lines.extend(self.f.readline() for k in range(end - start - len(lines)))
+        self.line = b''
+        return b''.join(lines)
+
+    def parse_block(self, block, nrows):
+        """
+        Parse a block from read_block into a float64 array in which NODATA cells are NaN.
+        """
+        if isinstance(block, bytes):
+            block = np.loadtxt(io.BytesIO(block), dtype=np.float64, ndmin=2) if block.strip() else np.empty((0, 0))
+        block = np.asarray(block, dtype=np.float64)
+        if block.shape != (nrows, self.get_shape()[1]):
+            raise ValueError('%s has a block of %s values, while %d rows of %d columns were expected' %
+                             (self.path, block.shape, nrows, self.get_shape()[1]))
+        if self.nodata is not None:
+            block[block == self.nodata] = np.nan
+        return block
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+def check_alignment(readers):
+    """
+    Check that the rasters have the same dimensions, origin and cell size.
+    :raise ValueError: if a raster is not aligned with the first raster
+    """
+    first = readers[0]
+    for reader in readers[1:]:
+        if reader.get_shape() != first.get_shape():
+            raise ValueError('%s has %d rows and %d columns, while %s has %d rows and %d columns' %
+                             ((reader.path,) + reader.get_shape() + (first.path,) + first.get_shape()))
+        if not np.allclose(get_geotransform(reader.header), get_geotransform(first.header)):
+            raise ValueError('Extent of %s %s is not the same as of %s %s' %
+                             (reader.path, get_geotransform(reader.header), first.path,
+                              get_geotransform(first.header)))
+
+
+def _evaluate_block(readers, blocks, nrows, operation, fill, nodata, decimals):
+    grids = [reader.parse_block(block, nrows) for reader, block in zip(readers, blocks)]
+    if fill is not None:
+        for grid in grids:
+            grid[np.isnan(grid)] = fill
+    with np.errstate(invalid='ignore'):
+        result = np.asarray(operation(grids), dtype=np.float64)
+    result[np.isnan(result)] = nodata
+    return encode_esri_rows(result, decimals=decimals)
+
+
+def evaluate_rasters(paths, operation, out_path, fill=None, nodata=None, decimals=2, block_rows=BLOCK_ROWS,
+                     threads=2):
+    """
+    Evaluate an operation over N aligned rasters block by block, and write the result as ESRI ASCII grid.
+    Blocks of rows are parsed and evaluated in parallel, while at most 2 * threads blocks are held in memory.
+    Rasters may be ESRI ASCII grids, which may be gzip or zstd compressed, or ESRI binary grids (.flt).
+    E.g. evaluate_rasters(['case1.asc', 'case2.asc'], 'difference', 'result.asc', fill=0.0)
+
+    :param paths: Raster file paths
+    :param operation: Name of OPERATIONS, or a function of a list of row blocks with NaN as NODATA, which returns the
+    result block with NaN as NODATA. E.g. threshold_mask(0.3)
+    :param string out_path: Result file path, which is compressed when it ends with .gz or .zst
+    :param float fill: If given, NODATA cells of the rasters are set to this value before the operation
+    :param nodata: NODATA value of the result. Default is the NODATA value of the first raster
+    :param int decimals: Number of decimal places of result values
+    :param int block_rows: Number of rows of a block
+    :param int threads: Number of threads which evaluate blocks
+    :raise ValueError: if the rasters are not aligned
+    """
+    operation = OPERATIONS[operation] if isinstance(operation, str) else operation
+    readers = [_RowBlockReader(path) for path in paths]
+    try:
+        check_alignment(readers)
+        first = readers[0]
+        if nodata is None:
+            nodata = first.nodata if first.nodata is not None else DEFAULT_NODATA
+            nodata = int(nodata) if nodata == int(nodata) else nodata
+        # Header of the first raster, with the NODATA value of the result
+        header = first.header.replace_lines({'NODATA_value': nodata}, exclude=['byteorder'])
+
+        nrows = first.get_shape()[0]
+        with open_raster(out_path, 'wb') as out, ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            out.write(''.join(header).encode())
+            pending = deque()
+            for start in range(0, nrows, block_rows):
+                end = min(start + block_rows, nrows)
+                blocks = [reader.read_block(start, end) for reader in readers]
+                pending.append(executor.submit(_evaluate_block, readers, blocks, end - start, operation, fill, nodata,
+                                               decimals))
+                if len(pending) >= 2 * max(1, threads):
+                    out.write(pending.popleft().result())
+            while pending:
+                out.write(pending.popleft().result())
+    finally:
+        for reader in readers:
+            reader.close()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+import numpy as np
+from netCDF4 import Dataset, num2date
+
+# Number of timesteps and rows / columns of each chunk. Reading a single frame touches one chunk row in time, and
+# reading the time series of a single cell touches one chunk column in space
+CHUNK_TIME = 16
+CHUNK_SIZE = 128
+
+
+class RasterStackWriter(object):
+    """
+    Write the grids of all timesteps into a single NetCDF4 cube of dims (time, y, x), with CF time metadata.
+    E.g. with RasterStackWriter('water_level_grid.nc', template, base_time) as stack:
+             stack.append(hour, grid)
+    """
+
+    def __init__(self, path, template, base_time, variable='depth', units='m', long_name='Water depth',
+                 chunk_time=CHUNK_TIME, chunk_size=CHUNK_SIZE, complevel=4):
+        """
+        :param string path: .nc file path
+        :param RasterTemplate template: util.LibRaster.RasterTemplate of the grids
+        :param datetime base_time: Base time of model hours
+        :param string variable: Name of the grid variable
+        :param string units: Units of the grid values
+        :param string long_name: Description of the grid variable
+        :param int chunk_time: Number of timesteps of a chunk
+        :param int chunk_size: Number of rows and columns of a chunk
+        :param int complevel: zlib compression level
+        """
+        self.path = path
+        self.template = template
+        self.dataset = Dataset(path, 'w', format='NETCDF4')
+        self.dataset.Conventions = 'CF-1.6'
+        self.dataset.source = 'FLO2D'
+        self.dataset.createDimension('time', None)
+        self.dataset.createDimension('y', template.nrows)
+        self.dataset.createDimension('x', template.ncols)
+
+        self.times = self.dataset.createVariable('time', 'f8', ('time',))
+        self.times.standard_name = 'time'
+        self.times.units = 'hours since %s' % base_time.strftime('%Y-%m-%d %H:%M:%S')
+        self.times.calendar = 'standard'
+        self.times.axis = 'T'
+
+        # Cell centers. Rows of the grid go from north to south, as in ESRI grids
+        x = self.dataset.createVariable('x', 'f8', ('x',))
+        x.standard_name = 'projection_x_coordinate'
+        x.units = 'm'
+        x[:] = template.xllcorner + (np.arange(template.ncols) + 0.5) * template.cellsize
+        y = self.dataset.createVariable('y', 'f8', ('y',))
+        y.standard_name = 'projection_y_coordinate'
+        y.units = 'm'
+        y[:] = template.yllcorner + (template.nrows - np.arange(template.nrows) - 0.5) * template.cellsize
+
+        chunks = (chunk_time, min(chunk_size, template.nrows), min(chunk_size, template.ncols))
+        self.values = self.dataset.createVariable(variable, 'f4', ('time', 'y', 'x'), zlib=True, complevel=complevel,
+                                                  shuffle=True, chunksizes=chunks, fill_value=template.nodata)
+        self.values.units = units
+        self.values.long_name = long_name
+
+    def append(self, hour, grid):
+        """
+        Append the grid of a timestep.
+
+        :param float hour: Model hour of the timestep
+        :param grid: nrows x ncols array with NaN as NODATA
+        """
+        index = len(self.times)
+        self.times[index] = hour
+        self.values[index, :, :] = np.ma.masked_invalid(grid)
+
+    def close(self):
+        self.dataset.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_raster_stack_frame(path, index, variable='depth'):
+    """
+    Read the grid of a single timestep.
+
+    :param string path: .nc file path
+    :param int index: Timestep index
+    :param string variable: Name of the grid variable
+    :return: (datetime of the timestep, nrows x ncols float32 array with NaN as NODATA)
+    """
+    with Dataset(path) as dataset:
+        times = dataset.variables['time']
+        grid = dataset.variables[variable][index, :, :]
+        return num2date(times[index], times.units, times.calendar), np.ma.filled(grid.astype(np.float32), np.nan)
+
+
+def read_raster_stack_series(path, row, col, variable='depth'):
+    """
+    Read the time series of a single cell.
+
+    :param string path: .nc file path
+    :param int row: Grid row counted from the top
+    :param int col: Grid column
+    :param string variable: Name of the grid variable
+    :return: (array of datetimes, float32 array of values with NaN as NODATA)
+    """
+    with Dataset(path) as dataset:
+        times = dataset.variables['time']
+        values = dataset.variables[variable][:, row, col]
+        return num2date(times[:], times.units, times.calendar), np.ma.filled(values.astype(np.float32), np.nan)
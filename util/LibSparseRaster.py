@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+from util.LibRaster import get_esri_header
+
+# Extension of sparse raster files, which are numpy .npz archives
+SPARSE_EXTENSION = '.npz'
+
+
+class SparseRasterWriter(object):
+    """
+    Write the wet cells of all timesteps into a single sparse raster file. For each timestep only the flat grid index
+    (row * ncols + col) and the value of cells which are not NODATA are stored.
+    E.g. with SparseRasterWriter('water_level_grid.npz', template, base_time) as sparse:
+             sparse.append(hour, grid)
+    """
+
+    def __init__(self, path, template, base_time, dtype=np.float32, compress=False):
+        """
+        :param string path: .npz file path
+        :param RasterTemplate template: util.LibRaster.RasterTemplate of the grids
+        :param datetime base_time: Base time of model hours
+        :param dtype: Value type. np.float16 halves the size, with about 3 significant digits
+        :param boolean compress: Whether to zip compress the arrays
+        """
+        self.path = path
+        self.template = template
+        self.base_time = base_time
+        self.dtype = dtype
+        self.compress = compress
+        self.hours = []
+        self.indices = []
+        self.values = []
+
+    def append(self, hour, grid):
+        """
+        Append the wet cells of the grid of a timestep.
+
+        :param float hour: Model hour of the timestep
+        :param grid: nrows x ncols array with NaN as NODATA
+        """
+        grid = np.asarray(grid).ravel()
+        index = np.flatnonzero(~np.isnan(grid))
+        self.hours.append(hour)
+        self.indices.append(index.astype(np.int32))
+        self.values.append(grid[index].astype(self.dtype))
+
+    def close(self):
+        template = self.template
+        counts = [len(index) for index in self.indices]
+        save = np.savez_compressed if self.compress else np.savez
+        save(self.path,
+             shape=np.array([template.nrows, template.ncols], dtype=np.int64),
+             # xllcorner, yllcorner, cellsize and NODATA value of the header
+             geotransform=np.array([template.xllcorner, template.yllcorner, template.cellsize, template.nodata],
+                                   dtype=np.float64),
+             base_time=np.array(self.base_time.strftime('%Y-%m-%dT%H:%M:%S'), dtype='datetime64[s]'),
+             hours=np.array(self.hours, dtype=np.float64),
+             offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+             index=np.concatenate(self.indices) if counts else np.empty(0, dtype=np.int32),
+             values=np.concatenate(self.values) if counts else np.empty(0, dtype=self.dtype))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SparseRaster(object):
+    """
+    Reader of sparse raster files, which rebuilds the dense grid of a timestep on demand.
+    E.g. for hour, grid in SparseRaster('water_level_grid.npz'):
+    """
+
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            self.nrows, self.ncols = (int(v) for v in data['shape'])
+            self.xllcorner, self.yllcorner, self.cellsize, nodata = data['geotransform'].tolist()
+            self.nodata = int(nodata) if nodata == int(nodata) else nodata
+            self.base_time = data['base_time'][()]
+            self.hours = data['hours']
+            self.offsets = data['offsets']
+            self.index = data['index']
+            self.values = data['values']
+
+    def __len__(self):
+        return len(self.hours)
+
+    def __iter__(self):
+        for k in range(len(self.hours)):
+            yield self.hours[k], self.get_grid(k)
+
+    def get_times(self):
+        """
+        :return: datetime64[s] array of timesteps
+        """
+        return self.base_time + np.round(self.hours * 3600).astype('timedelta64[s]')
+
+    def get_wet_cells(self, k):
+        """
+        :param int k: Timestep index
+        :return: (flat grid index, values) of the wet cells of the timestep
+        """
+        start, end = self.offsets[k], self.offsets[k + 1]
+        return self.index[start:end], self.values[start:end]
+
+    def get_grid(self, k):
+        """
+        Rebuild the dense grid of a timestep.
+
+        :param int k: Timestep index
+        :return: nrows x ncols float32 array with NaN as NODATA
+        """
+        index, values = self.get_wet_cells(k)
+        grid = np.full(self.nrows * self.ncols, np.nan, dtype=np.float32)
+        grid[index] = values
+        return grid.reshape(self.nrows, self.ncols)
+
+    def get_header(self):
+        """
+        :return: ESRI ASCII grid header lines of the grids
+        """
+        return get_esri_header(self.ncols, self.nrows, self.xllcorner, self.yllcorner, self.cellsize, self.nodata)
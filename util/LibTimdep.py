@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+
+import mmap
+import multiprocessing
+import os
+import re
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from util.LibCache import get_cache_key, load_cache, open_cache_entry, commit_cache_entry, discard_cache_entry
+from util.Utils import loadSidecar, saveSidecar
+
+# A timestep header is a line with a single token, the model hour. Every other line of the block is a grid element row.
+TIMESTEP_HEADER = re.compile(rb'^[ \t]*([-+.0-9Ee]+)[ \t]*\r?$', re.MULTILINE)
+INDEX_SUFFIX = '.idx'
+# Increase whenever parsed values change, to invalidate cached results
+PARSER_VERSION = 1
+
+
+def find_timesteps(path):
+    """
+    Locate the timestep blocks of a FLO2D TIMDEP.OUT file in a single scan.
+    E.g. A block which starts with the line '      1.00' at byte 0 and has 500 element rows is returned as
+    (1.0, 0, <byte length of the header and the rows>, 500)
+
+    :param string path: TIMDEP.OUT file path
+    :return: list of (model hour, header byte offset, byte length, row count) of each block
+    """
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return []
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            headers = [(float(m.group(1)), m.start(), m.end()) for m in TIMESTEP_HEADER.finditer(mm)]
+            timesteps = []
+            for k, (hour, start, header_end) in enumerate(headers):
+                end = headers[k + 1][1] if k + 1 < len(headers) else len(mm)
+                rows = mm[header_end + 1:end]
+                timesteps.append((hour, start, end - start, rows.count(b'\n') + (rows[-1:] not in (b'', b'\n'))))
+            return timesteps
+        finally:
+            mm.close()
+
+
+def get_timestep_index(path):
+    """
+    Get the timestep blocks of a TIMDEP.OUT file from the sidecar index saved next to it.
+    The index is rebuilt with find_timesteps when it is missing or the file was changed after it was built.
+
+    :param string path: TIMDEP.OUT file path
+    :return: list of (model hour, header byte offset, byte length, row count) of each block
+    """
+    timesteps = loadSidecar(path, INDEX_SUFFIX)
+    if timesteps is None:
+        timesteps = find_timesteps(path)
+        saveSidecar(path, INDEX_SUFFIX, timesteps)
+    return [tuple(t) for t in timesteps]
+
+
+def select_timesteps(timesteps, start_hour=None, end_hour=None):
+    """
+    Filter timestep blocks to the ones within [start_hour, end_hour]. Open ends are not filtered.
+    """
+    return [t for t in timesteps
+            if (start_hour is None or t[0] >= start_hour) and (end_hour is None or t[0] <= end_hour)]
+
+
+def read_timestep(f, timestep):
+    """
+    Read the element rows of a timestep block, without the model hour header line.
+
+    :param f: TIMDEP.OUT file opened in binary mode
+    :param timestep: (model hour, header byte offset, byte length, row count) of the block
+    :return: bytes
+    """
+    f.seek(timestep[1])
+    f.readline()
+    return f.read(timestep[1] + timestep[2] - f.tell())
+
+
+def _column_spans(rows):
+    """
+    Byte ranges of the columns of fixed width rows, which are the runs of byte positions that are not blank in every
+    row, so that each range covers exactly one token of each row whether the columns are left or right aligned.
+
+    :param rows: rows x width uint8 array of the rows, each ending with a newline
+    """
+    blank = ((rows == ord(' ')) | (rows == ord('\t')) | (rows == ord('\r')) | (rows == ord('\n'))).all(axis=0)
+    edges = np.flatnonzero(np.diff(np.concatenate([[1], blank.view(np.int8), [1]])))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def _parse_fixed_width(buf, column):
+    """
+    Parse the rows of a timestep block without tokenizing, if every row has the same width.
+    :return: (cell ids, values) or None if rows are not fixed width
+    """
+    width = buf.find(b'\n') + 1
+    if width <= 0 or len(buf) % width != 0:
+        return None
+    rows = np.frombuffer(buf, dtype=np.uint8).reshape(-1, width)
+    if not (rows[:, -1] == ord('\n')).all():
+        return None
+    spans = _column_spans(rows)
+    if len(spans) <= column:
+        return None
+
+    def field(k):
+        start, end = spans[k]
+        return np.ascontiguousarray(rows[:, start:end]).view('S%d' % (end - start)).ravel()
+
+    try:
+        return field(0).astype(np.int64), field(column).astype(np.float64)
+    except ValueError:
+        return None
+
+
+def parse_timestep(buf, column=1, dtype=np.float32):
+    """
+    Parse the element rows of a single TIMDEP.OUT timestep block in bulk.
+
+    :param bytes buf: Rows of the block, without the model hour header line
+    :param int column: Column to extract. 1 for flow depth, 5 for water surface elevation
+    :param dtype: dtype of returned values
+    :return: (cell ids, values) numpy arrays
+    """
+    # Only blank lines are stripped, since the first and the last rows keep their padding in fixed width columns
+    buf = buf.lstrip(b'\r\n')
+    end = len(buf.rstrip())
+    if not end:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=dtype)
+    newline = buf.find(b'\n', end)
+    buf = buf[:newline + 1] if newline >= 0 else buf + b'\n'
+    parsed = _parse_fixed_width(buf, column)
+    if parsed is None:
+        ncols = len(buf[:buf.find(b'\n')].split())
+        table = np.array(buf.split(), dtype=np.float64)
+        if ncols <= column or table.size % ncols != 0:
+            raise ValueError('Unable to parse TIMDEP block with %d columns for column %d' % (ncols, column))
+        table = table.reshape(-1, ncols)
+        parsed = table[:, 0].astype(np.int64), table[:, column]
+    return parsed[0], parsed[1].astype(dtype)
+
+
+def _iter_timesteps(path, timesteps, column=1, dtype=np.float32):
+    """
+    Iterate over given timestep blocks, yielding (model hour, values indexed by cell id) in a reused buffer.
+    """
+    buffer = np.full(1, np.nan, dtype=dtype)
+    with open(path, 'rb') as f:
+        for timestep in timesteps:
+            cells, levels = parse_timestep(read_timestep(f, timestep), column=column, dtype=dtype)
+            size = cells.max() + 1 if len(cells) else 0
+            if size > len(buffer):
+                buffer = np.empty(size, dtype=dtype)
+            buffer.fill(np.nan)
+            buffer[cells] = levels
+            yield timestep[0], buffer
+
+
+def iter_timesteps(path, cells=None, hours=None, column=1, dtype=np.float32):
+    """
+    Iterate over the timesteps of a FLO2D TIMDEP.OUT file one block at a time, so that memory use does not depend on
+    the number of timesteps. The same buffer is yielded for every timestep, copy it to keep the values.
+    E.g. for hour, depths in iter_timesteps('TIMDEP.OUT', hours=(12.0, 24.0)):
+
+    :param string path: TIMDEP.OUT file path
+    :param cells: If given, yield values of only these cell ids, in the given order
+    :param hours: If given, (start hour, end hour) of the timesteps to iterate over
+    :param int column: Column to extract. 1 for flow depth, 5 for water surface elevation
+    :param dtype: dtype of yielded values
+    :return: generator of (model hour, values) where values are indexed by cell id, or by position in cells.
+    Values of elements which are not present in a timestep are NaN.
+    """
+    start_hour, end_hour = hours if hours is not None else (None, None)
+    timesteps = select_timesteps(get_timestep_index(path), start_hour, end_hour)
+    if cells is None:
+        for hour, levels in _iter_timesteps(path, timesteps, column=column, dtype=dtype):
+            yield hour, levels
+        return
+
+    for hour, levels in _iter_projected(path, timesteps, np.asarray(cells, dtype=np.int64), column=column, dtype=dtype):
+        yield hour, levels
+
+
+def read_timdep_cells(path, cells, column=1, dtype=np.float32, start_hour=None, end_hour=None):
+    """
+    Read the time series of a few cells of a FLO2D TIMDEP.OUT file into arrays preallocated from the timestep index.
+    E.g. hours, levels = read_timdep_cells('TIMDEP.OUT', [24, 153], column=5) where levels[:, 1] is the water surface
+    elevation series of cell 153.
+
+    :param string path: TIMDEP.OUT file path
+    :param cells: Cell ids
+    :param int column: Column to extract. 1 for flow depth, 5 for water surface elevation
+    :param dtype: dtype of returned values
+    :param float start_hour: If given, skip timesteps before this model hour
+    :param float end_hour: If given, skip timesteps after this model hour
+    :return: (model hours, values) where values is a timesteps x cells array. Missing values are NaN
+    """
+    timesteps = select_timesteps(get_timestep_index(path), start_hour, end_hour)
+    cells = np.asarray(cells, dtype=np.int64)
+    hours = np.empty(len(timesteps), dtype=np.float64)
+    values = np.empty((len(timesteps), len(cells)), dtype=dtype)
+    for k, (hour, levels) in enumerate(_iter_projected(path, timesteps, cells, column=column, dtype=dtype)):
+        hours[k] = hour
+        values[k] = levels
+    return hours, values
+
+
+def _iter_projected(path, timesteps, cells, column=1, dtype=np.float32):
+    """
+    Iterate over given timestep blocks, yielding (model hour, values of cells) in a reused buffer.
+    Element rows are at the same position in every block, so a row index of the cells is built from the first block
+    and only the bytes of those rows are read from the following blocks. Blocks with a different layout, or where a
+    row does not hold the expected cell, are parsed in full and the row index is rebuilt from them.
+    """
+    buffer = np.empty(len(cells), dtype=dtype)
+    layout = None  # (row count, row width) the row index was built for
+    rows = found = None
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for hour, offset, length, row_count in timesteps:
+                rows_start = mm.find(b'\n', offset, offset + length) + 1
+                width = mm.find(b'\n', rows_start, offset + length) + 1 - rows_start
+                is_fixed = width > 0 and offset + length - rows_start == row_count * width
+                buffer.fill(np.nan)
+                if is_fixed and layout == (row_count, width):
+                    parsed = _parse_fixed_width(
+                        b''.join(mm[rows_start + r * width:rows_start + (r + 1) * width] for r in rows), column)
+                    if parsed is not None and np.array_equal(parsed[0], cells[found]):
+                        buffer[found] = parsed[1]
+                        yield hour, buffer
+                        continue
+                block_cells, levels = parse_timestep(mm[rows_start:offset + length], column=column, dtype=dtype)
+                position = {cell: k for k, cell in enumerate(block_cells.tolist())}
+                found = np.array([k for k, cell in enumerate(cells.tolist()) if cell in position], dtype=np.int64)
+                rows = [position[cell] for cell in cells[found].tolist()]
+                layout = (row_count, width) if is_fixed else None
+                buffer[found] = levels[rows]
+                yield hour, buffer
+        finally:
+            mm.close()
+
+
+def _fill_timesteps(path, timesteps, values, first_row=0, column=1):
+    """
+    Parse given timestep blocks into consecutive rows of values, starting from first_row.
+    :return: False if a block has cell ids beyond the columns of values, otherwise True
+    """
+    for k, (hour, levels) in enumerate(_iter_timesteps(path, timesteps, column=column, dtype=values.dtype)):
+        if len(levels) > values.shape[1]:
+            return False
+        values[first_row + k, :len(levels)] = levels
+        values[first_row + k, len(levels):] = np.nan
+    return True
+
+
+def _fill_timesteps_worker(task):
+    """
+    Process pool worker of _fill_timesteps_parallel. The result array is either a shared memory block or a .npy file.
+    """
+    path, timesteps, first_row, column, target, shape, dtype = task
+    kind, name = target
+    if kind == 'npy':
+        values = np.load(name, mmap_mode='r+')
+        try:
+            return _fill_timesteps(path, timesteps, values, first_row, column)
+        finally:
+            values.flush()
+            del values
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        try:
+            return _fill_timesteps(path, timesteps, values, first_row, column)
+        finally:
+            del values
+    finally:
+        shm.close()
+
+
+def _fill_timesteps_parallel(path, timesteps, target, shape, dtype, column, processes):
+    """
+    Parse timestep blocks in a process pool. Blocks are split into contiguous byte ranges which start at a timestep
+    header, and each worker writes its rows straight into the shared result array.
+
+    :param target: ('shm', shared memory name) or ('npy', .npy file path) of the timesteps x cells result array
+    :return: False if a block has cell ids beyond the columns of the result array, otherwise True
+    """
+    # A few ranges per process keeps the workers busy when blocks differ in size
+    size = max(1, -(-len(timesteps) // (processes * 4)))
+    tasks = [(path, timesteps[i:i + size], i, column, target, shape, np.dtype(dtype).name)
+             for i in range(0, len(timesteps), size)]
+    # Workers are forked, since spawned workers would re-import and run the calling script, which has no main guard.
+    # Without fork, e.g. on Windows, the ranges are parsed in this process
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return all(map(_fill_timesteps_worker, tasks))
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        return all(pool.map(_fill_timesteps_worker, tasks))
+
+
+def _get_cell_count(path, timesteps, column=1, dtype=np.float32):
+    """
+    Number of columns needed to index the values of the first timestep by cell id.
+    """
+    for hour, levels in _iter_timesteps(path, timesteps[:1], column=column, dtype=dtype):
+        return len(levels)
+    return 1
+
+
+def _read_timdep_parallel(path, timesteps, column, dtype, processes):
+    shape = (len(timesteps), _get_cell_count(path, timesteps, column, dtype))
+    shm = shared_memory.SharedMemory(create=True, size=max(shape[0] * shape[1] * np.dtype(dtype).itemsize, 1))
+    try:
+        if not _fill_timesteps_parallel(path, timesteps, ('shm', shm.name), shape, dtype, column, processes):
+            return None
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def read_timdep(path, column=1, dtype=np.float32, start_hour=None, end_hour=None, processes=1):
+    """
+    Read the timesteps of a FLO2D TIMDEP.OUT file.
+    E.g. depths[t, 179] is the flow depth of grid element 179 at model hour hours[t].
+    Values of elements which are not present in a timestep are NaN.
+
+    :param string path: TIMDEP.OUT file path
+    :param int column: Column to extract. 1 for flow depth, 5 for water surface elevation
+    :param dtype: dtype of returned values
+    :param float start_hour: If given, skip timesteps before this model hour
+    :param float end_hour: If given, skip timesteps after this model hour
+    :param int processes: Number of processes to parse timesteps in parallel. Result is the same as with 1 process
+    :return: (model hours, values) where values is a timesteps x (max cell id + 1) array indexed by cell id
+    """
+    timesteps = select_timesteps(get_timestep_index(path), start_hour, end_hour)
+    hours = np.array([t[0] for t in timesteps], dtype=np.float64)
+    if processes > 1 and len(timesteps) > 1:
+        values = _read_timdep_parallel(path, timesteps, column, dtype, processes)
+        if values is not None:
+            return hours, values
+
+    values = np.full((len(timesteps), 1), np.nan, dtype=dtype)
+    for k, (hour, levels) in enumerate(_iter_timesteps(path, timesteps, column=column, dtype=dtype)):
+        if len(levels) > values.shape[1]:
+            grown = np.full((len(timesteps), len(levels)), np.nan, dtype=dtype)
+            grown[:, :values.shape[1]] = values
+            values = grown
+        values[k, :len(levels)] = levels
+    return hours, values
+
+
+def load_timdep(path, column=1, dtype=np.float32, cache_dir=None, processes=1):
+    """
+    Same as read_timdep, but the parsed arrays are cached on disk. Repeated loads of the same run return read only
+    memory maps of the cached arrays without parsing the file again.
+    On a cache miss the timesteps are streamed into the cache file, so that the whole file is never held in memory.
+
+    :param string path: TIMDEP.OUT file path
+    :param int column: Column to extract. 1 for flow depth, 5 for water surface elevation
+    :param dtype: dtype of returned values
+    :param string cache_dir: Cache directory. Default is util.LibCache.CACHE_DIR
+    :param int processes: Number of processes to parse timesteps in parallel on a cache miss
+    :return: (model hours, values)
+    """
+    key = get_cache_key(path, 'timdep', PARSER_VERSION, {'column': column, 'dtype': np.dtype(dtype).name})
+    data = load_cache(key, cache_dir)
+    if data is not None:
+        return data
+
+    tmp_dir = open_cache_entry(cache_dir)
+    if tmp_dir is None:
+        return read_timdep(path, column=column, dtype=dtype, processes=processes)
+    timesteps = get_timestep_index(path)
+    values_file = os.path.join(tmp_dir, '1.npy')
+    shape = (len(timesteps), _get_cell_count(path, timesteps, column, dtype))
+    values = np.lib.format.open_memmap(values_file, mode='w+', dtype=dtype, shape=shape)
+    if processes > 1 and len(timesteps) > 1:
+        del values
+        is_filled = _fill_timesteps_parallel(path, timesteps, ('npy', values_file), shape, dtype, column, processes)
+    else:
+        is_filled = _fill_timesteps(path, timesteps, values, column=column)
+        values.flush()
+        del values
+    if not is_filled:
+        # Cell ids beyond the first timestep, which does not happen with FLO2D outputs
+        discard_cache_entry(tmp_dir)
+        return read_timdep(path, column=column, dtype=dtype)
+    np.save(os.path.join(tmp_dir, '0.npy'), np.array([t[0] for t in timesteps], dtype=np.float64))
+    commit_cache_entry(key, tmp_dir, ['0', '1'], cache_dir=cache_dir)
+    data = load_cache(key, cache_dir)
+    return data if data is not None else read_timdep(path, column=column, dtype=dtype)
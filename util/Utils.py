@@ -1,5 +1,5 @@
 #!/usr/bin/python3
-import datetime, re
+import datetime, json, os, re
 
 
 def getUTCOffset(utcOffset, default=False):
@@ -29,3 +29,48 @@ def getUTCOffset(utcOffset, default=False):
     if utcOffset[0] == "+":  # If timestamp in positive zone, deduct it to current time
         offset_str = utcOffset[1:].split(':')
         return datetime.timedelta(hours=-1 * int(offset_str[0]), minutes=-1 * int(offset_str[1]))
+
+
+def getFileFingerprint(path):
+    """
+    Get size and modification time of given file, which changes whenever the file is rewritten.
+    E.g. {'size': 1048576, 'mtime': 1544745600000000000}
+
+    :param string path: File path
+    """
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def loadSidecar(path, suffix):
+    """
+    Load the JSON sidecar file saved next to given file by saveSidecar.
+    Return None if the sidecar does not exists or it was written for a different version of the file.
+
+    :param string path: File path which the sidecar describes
+    :param string suffix: Sidecar file suffix. E.g. '.idx'
+    """
+    try:
+        with open(path + suffix) as f:
+            sidecar = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if sidecar.get('fingerprint') != getFileFingerprint(path):
+        return None
+    return sidecar.get('data')
+
+
+def saveSidecar(path, suffix, data):
+    """
+    Save JSON serializable data next to given file along with the file fingerprint.
+    Silently skip if the directory is not writable, since the sidecar is only an optimization.
+
+    :param string path: File path which the sidecar describes
+    :param string suffix: Sidecar file suffix. E.g. '.idx'
+    :param data: JSON serializable data
+    """
+    try:
+        with open(path + suffix, 'w') as f:
+            json.dump({'fingerprint': getFileFingerprint(path), 'data': data}, f)
+    except OSError as e:
+        print('Unable to save', path + suffix, ':', e)
@@ -13,6 +13,8 @@ from curwmysqladapter import MySQLAdapter
 from mpl_toolkits.basemap import Basemap
 from netCDF4._netCDF4 import Dataset
 
+from util.LibRaster import read_raster, write_esri_rows
+
 
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
@@ -148,24 +150,18 @@ def create_asc_file(data, lats, lons, out_file_path, cell_size=0.1, no_data_val=
             out_file.write(('CELLSIZE %f\n' % cell_size).encode())
             out_file.write(('NODATA_VALUE %d\n' % no_data_val).encode())
 
-            np.savetxt(out_file, data, fmt='%.4f')
+            write_esri_rows(out_file, data, decimals=4)
     else:
         logging.info('%s already exits' % out_file_path)
 
 
 def read_asc_file(path):
     """
-    reads a esri asci file
+    reads a esri asci file, which may be gzip or zstd compressed (.gz or .zst)
     :param path: file path
     :return: (data, meta data)
     """
-    meta = {}
-    with open(path) as f:
-        for i in range(6):
-            line = next(f).split()
-            meta[line[0]] = float(line[1])
-
-    data = np.genfromtxt(path, skip_header=6)
+    data, geotransform, meta = read_raster(path)
     return data, meta
 
 
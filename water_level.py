@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import csv
+import math
 import os
 import sys
 import traceback
@@ -9,6 +10,7 @@ from os.path import join as pjoin
 import copy
 from util.LibForecastTimeseries import extractForecastTimeseries
 from util.LibForecastTimeseries import extractForecastTimeseriesInDays
+from util.LibHychan import load_hychan
 from util.Utils import getUTCOffset
 
 COMMON_DATE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -56,14 +58,6 @@ def get_water_level_of_channels(lines, channels=None):
     return water_levels
 
 
-def isfloat(value):
-    try:
-        float(value)
-        return True
-    except ValueError:
-        return False
-
-
 def divideTimeseriesInDays(timeseries):
     print('divideTimeseriesInDays|timeseries : ', timeseries)
     print('divideTimeseriesInDays | timeseries[0] : ', timeseries[0])
@@ -191,7 +185,6 @@ try:
 
     ELEMENT_NUMBERS = CHANNEL_CELL_MAP.keys()
     FLOOD_ELEMENT_NUMBERS = FLOOD_PLAIN_CELL_MAP.keys()
-    SERIES_LENGTH = 0
     MISSING_VALUE = -999
 
     date = '2018-12-14'
@@ -216,118 +209,43 @@ try:
     if not os.path.exists(OUTPUT_DIR_PATH):
         os.makedirs(OUTPUT_DIR_PATH)
 
-    # Calculate the size of time series
-    bufsize = 65536
-    with open(HYCHAN_OUT_FILE_PATH) as infile:
-        isWaterLevelLines = False
-        isCounting = False
-        countSeriesSize = 0  # HACK: When it comes to the end of file, unable to detect end of time series
-        while True:
-            lines = infile.readlines(bufsize)
-            if not lines or SERIES_LENGTH:
-                break
-            for line in lines:
-                if line.startswith('CHANNEL HYDROGRAPH FOR ELEMENT NO:', 5):
-                    isWaterLevelLines = True
-                elif isWaterLevelLines:
-                    cols = line.split()
-                    # print('cols : ',cols)
-                    if len(cols) > 0 and cols[0].replace('.', '', 1).isdigit():
-                        countSeriesSize += 1
-                        isCounting = True
-                    elif isWaterLevelLines and isCounting:
-                        SERIES_LENGTH = countSeriesSize
-                        break
-
-    print('Series Length is :', SERIES_LENGTH)
-    bufsize = 65536
     #################################################################
     # Extract Channel Water Level elevations from HYCHAN.OUT file   #
     #################################################################
     print('Extract Channel Water Level Result of FLO2D HYCHAN.OUT on', date, '@', time, 'with Bast time of', start_date,
           '@', start_time)
-    with open(HYCHAN_OUT_FILE_PATH) as infile:
-        isWaterLevelLines = False
-        isSeriesComplete = False
-        waterLevelLines = []
-        seriesSize = 0  # HACK: When it comes to the end of file, unable to detect end of time series
-        while True:
-            lines = infile.readlines(bufsize)
-            if not lines:
-                break
-            for line in lines:
-                if line.startswith('CHANNEL HYDROGRAPH FOR ELEMENT NO:', 5):
-                    seriesSize = 0
-                    elementNo = line.split()[5]
-
-                    if elementNo in ELEMENT_NUMBERS:
-                        isWaterLevelLines = True
-                        waterLevelLines.append(line)
-                    else:
-                        isWaterLevelLines = False
+    baseTime = datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
+    for elementNo, hydrograph in load_hychan(HYCHAN_OUT_FILE_PATH, elements=ELEMENT_NUMBERS).items():
+        timeseries = []
+        # print('Extracted Cell No', elementNo, CHANNEL_CELL_MAP[elementNo])
+        # Get flood level (Elevation). Use hydrograph['depth'] for flood depth (Depth)
+        for timeStep, value in zip(hydrograph['time'].tolist(), hydrograph['elevation'].tolist()):
+            if math.isnan(value):
+                continue  # If value is not present or NaN, skip
+            currentStepTime = baseTime + timedelta(hours=timeStep)
+            dateAndTime = currentStepTime.strftime("%Y-%m-%d %H:%M:%S")
+            timeseries.append([dateAndTime, value])
 
-                elif isWaterLevelLines:
-                    cols = line.split()
-                    if len(cols) > 0 and isfloat(cols[0]):
-                        seriesSize += 1
-                        waterLevelLines.append(line)
-
-                        if seriesSize == SERIES_LENGTH:
-                            isSeriesComplete = True
-
-                if isSeriesComplete:
-                    baseTime = datetime.strptime('%s %s' % (start_date, start_time), '%Y-%m-%d %H:%M:%S')
-                    timeseries = []
-                    elementNo = waterLevelLines[0].split()[5]
-                    # print('Extracted Cell No', elementNo, CHANNEL_CELL_MAP[elementNo])
-                    for ts in waterLevelLines[1:]:
-                        v = ts.split()
-                        if len(v) < 1:
-                            continue
-                        # Get flood level (Elevation)
-                        value = v[1]
-                        # Get flood depth (Depth)
-                        # value = v[2]
-                        if not isfloat(value):
-                            value = MISSING_VALUE
-                            continue  # If value is not present, skip
-                        if value == 'NaN':
-                            continue  # If value is NaN, skip
-                        timeStep = float(v[0])
-                        currentStepTime = baseTime + timedelta(hours=timeStep)
-                        dateAndTime = currentStepTime.strftime("%Y-%m-%d %H:%M:%S")
-                        timeseries.append([dateAndTime, value])
-
-                    # Create Directory
-                    if not os.path.exists(WATER_LEVEL_DIR_PATH):
-                        os.makedirs(WATER_LEVEL_DIR_PATH)
-                    # Get Time stamp Ref:http://stackoverflow.com/a/13685221/1461060
-                    ModelTime = float(waterLevelLines[1].split()[3])
-                    fileModelTime = datetime.strptime(date, '%Y-%m-%d')
-                    fileModelTime = fileModelTime + timedelta(hours=ModelTime)
-                    dateAndTime = fileModelTime.strftime("%Y-%m-%d_%H-%M-%S")
-                    # Create files
-                    fileName = WATER_LEVEL_FILE.rsplit('.', 1)
-                    stationName = CHANNEL_CELL_MAP[elementNo].replace(' ', '_')
-                    fileTimestamp = "%s_%s" % (date, time.replace(':', '-'))
-                    fileName = "%s-%s-%s.%s" % (fileName[0], stationName, fileTimestamp, fileName[1])
-                    WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
-                    csvWriter = csv.writer(open(WATER_LEVEL_FILE_PATH, 'w'), delimiter=',', quotechar='|')
-                    csvWriter.writerows(timeseries)
-                    opts = {
-                        'forceInsert': forceInsert,
-                        'station': CHANNEL_CELL_MAP[elementNo],
-                        'run_name': runName
-                    }
-                    # print('>>>>>', opts)
-                    if utcOffset != timedelta():
-                        opts['utcOffset'] = utcOffset
-                    save_forecast_timeseries(timeseries, date, time, opts)
-                    isWaterLevelLines = False
-                    isSeriesComplete = False
-                    waterLevelLines = []
-            # -- END for loop
-        # -- END while loop
+        # Create Directory
+        if not os.path.exists(WATER_LEVEL_DIR_PATH):
+            os.makedirs(WATER_LEVEL_DIR_PATH)
+        # Create files
+        fileName = WATER_LEVEL_FILE.rsplit('.', 1)
+        stationName = CHANNEL_CELL_MAP[elementNo].replace(' ', '_')
+        fileTimestamp = "%s_%s" % (date, time.replace(':', '-'))
+        fileName = "%s-%s-%s.%s" % (fileName[0], stationName, fileTimestamp, fileName[1])
+        WATER_LEVEL_FILE_PATH = pjoin(WATER_LEVEL_DIR_PATH, fileName)
+        csvWriter = csv.writer(open(WATER_LEVEL_FILE_PATH, 'w'), delimiter=',', quotechar='|')
+        csvWriter.writerows(timeseries)
+        opts = {
+            'forceInsert': forceInsert,
+            'station': CHANNEL_CELL_MAP[elementNo],
+            'run_name': runName
+        }
+        # print('>>>>>', opts)
+        if utcOffset != timedelta():
+            opts['utcOffset'] = utcOffset
+        save_forecast_timeseries(timeseries, date, time, opts)
 
     #################################################################
     # Extract Flood Plain water elevations from BASE.OUT file       #
@@ -336,9 +254,10 @@ try:
     print('TIMEDEP_FILE_PATH : ', TIMEDEP_FILE_PATH)
     print('Extract Flood Plain Water Level Result of FLO2D on', date, '@', time, 'with Bast time of', start_date, '@',
           start_time)
+    bufsize = 65536
     with open(TIMEDEP_FILE_PATH) as infile:
         waterLevelLines = []
-        waterLevelSeriesDict = dict.fromkeys(FLOOD_ELEMENT_NUMBERS, [])
+        waterLevelSeriesDict = {elementNo: [] for elementNo in FLOOD_ELEMENT_NUMBERS}
         while True:
             lines = infile.readlines(bufsize)
             if not lines:
@@ -360,12 +279,8 @@ try:
                         dateAndTime = currentStepTime.strftime("%Y-%m-%d %H:%M:%S")
 
                         for elementNo in FLOOD_ELEMENT_NUMBERS:
-                            tmpTS = waterLevelSeriesDict[elementNo][:]
-                            if elementNo in waterLevels:
-                                tmpTS.append([dateAndTime, waterLevels[elementNo]])
-                            else:
-                                tmpTS.append([dateAndTime, MISSING_VALUE])
-                            waterLevelSeriesDict[elementNo] = tmpTS
+                            waterLevelSeriesDict[elementNo].append(
+                                [dateAndTime, waterLevels.get(elementNo, MISSING_VALUE)])
 
                         isWaterLevelLines = False
                         # for l in waterLevelLines :
@@ -389,12 +304,8 @@ try:
             dateAndTime = currentStepTime.strftime("%Y-%m-%d %H:%M:%S")
 
             for elementNo in FLOOD_ELEMENT_NUMBERS:
-                tmpTS = waterLevelSeriesDict[elementNo][:]
-                if elementNo in waterLevels:
-                    tmpTS.append([dateAndTime, waterLevels[elementNo]])
-                else:
-                    tmpTS.append([dateAndTime, MISSING_VALUE])
-                waterLevelSeriesDict[elementNo] = tmpTS
+                waterLevelSeriesDict[elementNo].append(
+                    [dateAndTime, waterLevels.get(elementNo, MISSING_VALUE)])
 
             isWaterLevelLines = False
             # for l in waterLevelLines :